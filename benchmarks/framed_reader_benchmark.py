@@ -0,0 +1,74 @@
+"""Measure reading and decoding a big tab snapshot with tabprotocol.FramedReader.
+
+The frame is written through a pipe by another thread. Every wakeup reads
+until the pipe is empty, so the number of wakeups depends on how the two
+threads are scheduled, and varies from run to run.
+
+Usage: python3 benchmarks/framed_reader_benchmark.py [NR_TABS ...]
+"""
+import os
+import sys
+import time
+import select
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tabprotocol
+
+
+DEFAULT_NR_TABS = (1000, 25000)
+ENCODINGS = {"json": tabprotocol.ENCODING_JSON, "marshal": tabprotocol.ENCODING_MARSHAL}
+
+
+def generate_tabs(nr_tabs):
+    return [{'title': "Some page title number {} - Mozilla Firefox".format(tab_id),
+             'id': tab_id,
+             'url': "https://www.example.com/some/path/to/page/{}?query=string".format(tab_id),
+             'favIconUrl': "https://www.example.com/favicon.ico",
+             'windowId': 1,
+             'active': False}
+            for tab_id in range(nr_tabs)]
+
+
+def write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+    os.close(fd)
+
+
+def measure(frame):
+    """Returns the time it took to read and decode the frame, and the number of wakeups."""
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    reader = tabprotocol.FramedReader(read_fd)
+    writer = threading.Thread(target=write_all, args=(write_fd, frame))
+    start = time.perf_counter()
+    writer.start()
+    nr_wakeups = 0
+    message = None
+    while message is None:
+        select.select([read_fd], [], [])
+        nr_wakeups += 1
+        reader.read()
+        message = reader.pop_message()
+    elapsed = time.perf_counter() - start
+    writer.join()
+    os.close(read_fd)
+    return elapsed, nr_wakeups
+
+
+def main():
+    nr_tabs_list = [int(arg) for arg in sys.argv[1:]] or DEFAULT_NR_TABS
+    print("{:>8} {:>8} {:>12} {:>10} {:>8}".format("tabs", "encoding", "frame (KB)", "time (ms)", "wakeups"))
+    for nr_tabs in nr_tabs_list:
+        snapshot = {'op': tabprotocol.OP_SNAPSHOT, 'epoch': "benchmark", 'version': nr_tabs,
+                    'tabs': generate_tabs(nr_tabs)}
+        for encoding_name, encoding in ENCODINGS.items():
+            frame = tabprotocol.encode_frame(snapshot, encoding)
+            elapsed, nr_wakeups = measure(frame)
+            print("{:>8} {:>8} {:>12} {:>10.1f} {:>8}".format(nr_tabs, encoding_name, len(frame) // 1024,
+                                                             elapsed * 1000, nr_wakeups))
+
+
+if __name__ == "__main__":
+    main()
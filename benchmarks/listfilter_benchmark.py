@@ -0,0 +1,299 @@
+"""Measure the latency of filtering windows and tabs per keystroke.
+
+Synthetic corpora of window and tab titles are filtered by scripted typing
+sessions, and every keystroke is timed in two stages:
+
+- listfilter: ListFilter.update_search_key, and get_candidate_score of
+  every matching candidate.
+- pipeline: what the switcher does per keystroke without GTK, see Pipeline.
+
+Results are printed, and can be saved as JSON and compared with the
+results of another commit.
+
+Usage: python3 benchmarks/listfilter_benchmark.py [--sizes 100,1000] [--output results.json]
+                                                  [--compare baseline.json]
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import functools
+import subprocess
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import listfilter
+import windowsnapshot
+
+
+DEFAULT_SIZES = (100, 1000, 10000, 50000)
+NR_BROWSERS = 3
+# Of the titles, the rest are tabs
+WINDOWS_RATIO = 0.05
+# Sessions are repeated to have enough keystrokes for percentiles, within a time budget
+MIN_NR_KEYSTROKES_PER_SESSION = 200
+SESSION_TIME_BUDGET_SECONDS = 1.0
+BACKSPACE = '\b'
+SESSIONS = {
+    'word': "github",
+    'two_words': "inbox gmail",
+    'typo_and_fix': "pyhton" + BACKSPACE * 3 + "thon docs",
+    'retype': "issue 12" + BACKSPACE * 8 + "wikipedia",
+    'non_ascii': "москва",
+    'no_match': "qzxjvw",
+}
+SEED = 1234
+
+WORDS = ("fix", "add", "support", "error", "parser", "release", "notes", "build", "failing", "cache", "memory",
+         "leak", "window", "switcher", "python", "docs", "tutorial", "review", "update", "config", "server",
+         "client", "latency", "profile", "benchmark", "design", "meeting", "weekly", "report", "budget",
+         "invoice", "travel", "recipe", "garden", "music", "playlist", "football", "weather", "news")
+NON_ASCII_WORDS = ("Москва", "погода", "новости", "Zürich", "café", "résumé", "東京", "天気", "שלום", "São Paulo")
+SITES = ("{} · Issue #{} · {}/{}", "{} by {} · Pull Request #{} · {}/{}", "{} - YouTube", "Inbox ({}) - {}@gmail.com - Gmail",
+         "{} - Wikipedia", "python - {} - Stack Overflow", "[{}-{}] {} - Jira", "{} | Google Docs", "{} - Reddit")
+APPS = (("gnome-terminal-server.Gnome-terminal", "{}@laptop: ~/src/{}"),
+        ("code.Code", "{}.py - {} - Visual Studio Code"),
+        ("evince.Evince", "{} {}.pdf"),
+        ("nautilus.Nautilus", "{}"),
+        ("slack.Slack", "Slack | {} | {}"))
+BROWSERS = (("Navigator.Firefox", "Mozilla Firefox"), ("google-chrome.Google-chrome", "Google Chrome"),
+            ("Navigator.firefox-beta", "Firefox Beta"))
+
+
+class Corpus(object):
+    """Windows, and the tabs of the browser windows by PID, shaped like the switcher's."""
+    def __init__(self, nr_titles, rng):
+        self.windows = list()
+        self.tabs = dict()
+        nr_windows = max(1, int(nr_titles * WINDOWS_RATIO))
+        nr_tabs = max(0, nr_titles - nr_windows - NR_BROWSERS)
+        for index in range(NR_BROWSERS):
+            wm_class, name = BROWSERS[index % len(BROWSERS)]
+            pid = 1000 + index
+            tabs = [self._create_tab(tab_id, rng) for tab_id in range(index, nr_tabs, NR_BROWSERS)]
+            self.tabs[pid] = tabs
+            title = "{} - {}".format(tabs[0]['title'] if tabs else "New Tab", name)
+            self.windows.append(self._create_window(pid, wm_class, title, True))
+        for index in range(nr_windows):
+            wm_class, title_format = APPS[index % len(APPS)]
+            title = title_format.format(*self._get_words(rng, title_format.count("{}")))
+            self.windows.append(self._create_window(2000 + index, wm_class, title, False))
+
+    def _create_window(self, pid, wm_class, title, is_browser):
+        return windowsnapshot.SnapshotWindow(len(self.windows) + 0x1000000, pid, wm_class, title,
+                                             listfilter.normalize(title), listfilter.normalize(wm_class),
+                                             is_browser)
+
+    def _create_tab(self, tab_id, rng):
+        title_format = rng.choice(SITES)
+        title = title_format.format(*self._get_words(rng, title_format.count("{}")))
+        return {'id': tab_id, 'title': title, 'normalized_title': listfilter.normalize(title)}
+
+    @staticmethod
+    def _get_words(rng, nr_fields):
+        fields = list()
+        for _ in range(nr_fields):
+            if rng.random() < 0.3:
+                fields.append(str(rng.randrange(1, 20000)))
+            else:
+                words = NON_ASCII_WORDS if rng.random() < 0.1 else WORDS
+                fields.append(' '.join(rng.choice(words) for _ in range(rng.randrange(1, 5))))
+        return fields
+
+
+class Pipeline(object):
+    """The work the switcher does per keystroke, without GTK.
+
+    Like EntryWindow._text_changed_callback, the filter is narrowed, the
+    titles of browser windows are scored, and the rows whose candidates
+    started or stopped matching are updated. The windows are then ranked
+    with the comparison of EntryWindow._compare_windows.
+    """
+    def __init__(self, corpus):
+        self._windows = corpus.windows
+        self._browser_titles = [window.normalized_title for window in self._windows if window.is_browser()]
+        self._row_candidates = dict()
+        for window in self._windows:
+            tabs = corpus.tabs.get(window.pid, ()) if window.is_browser() else ()
+            token = window.normalized_title + ''.join(tab['normalized_title'] for tab in tabs)
+            self._row_candidates[(window.xid, -1)] = (token, window.normalized_wm_class)
+            for tab in tabs:
+                self._row_candidates[(window.xid, tab['id'])] = (tab['normalized_title'], window.normalized_wm_class)
+        self._candidate_rows = dict()
+        for row_key, candidates in self._row_candidates.items():
+            for candidate in candidates:
+                self._candidate_rows.setdefault(candidate, list()).append(row_key)
+        self.listfilter = listfilter.ListFilter()
+        self.listfilter.set_candidates(self._candidate_rows.keys())
+        self._matching_candidates = self.listfilter.get_matches()
+        self._visible_rows = set(self._row_candidates)
+
+    def update_search_key(self, search_key):
+        self.listfilter.update_search_key(search_key)
+        self.listfilter.score_many(self._browser_titles)
+        matching_candidates = self.listfilter.get_matches()
+        changed_candidates = matching_candidates ^ self._matching_candidates
+        self._matching_candidates = matching_candidates
+        for candidate in changed_candidates:
+            for row_key in self._candidate_rows.get(candidate, ()):
+                if any(row_candidate in matching_candidates for row_candidate in self._row_candidates[row_key]):
+                    self._visible_rows.add(row_key)
+                else:
+                    self._visible_rows.discard(row_key)
+        return sorted(self._windows, key=functools.cmp_to_key(self._compare_windows))
+
+    def _compare_windows(self, window_a, window_b):
+        window_a_score = self._get_score(window_a)
+        window_b_score = self._get_score(window_b)
+        if window_a_score > window_b_score:
+            return -1
+        elif window_b_score > window_a_score:
+            return 1
+        return 0
+
+    def _get_score(self, window):
+        score = self.listfilter.get_candidate_score(window.normalized_title)
+        if window.normalized_wm_class:
+            score = max(score, self.listfilter.get_candidate_score(window.normalized_wm_class))
+        return score
+
+
+def get_search_keys(session):
+    """The search key after every keystroke of a session."""
+    search_keys = list()
+    search_key = ""
+    for key in session:
+        search_key = search_key[:-1] if key == BACKSPACE else search_key + key
+        search_keys.append(search_key)
+    return search_keys
+
+
+def time_listfilter_keystroke(pipeline, search_key):
+    start = time.perf_counter()
+    pipeline.listfilter.update_search_key(search_key)
+    for candidate in pipeline.listfilter.get_matches():
+        pipeline.listfilter.get_candidate_score(candidate)
+    return time.perf_counter() - start
+
+
+def time_pipeline_keystroke(pipeline, search_key):
+    start = time.perf_counter()
+    pipeline.update_search_key(search_key)
+    return time.perf_counter() - start
+
+
+STAGES = {'listfilter': time_listfilter_keystroke, 'pipeline': time_pipeline_keystroke}
+
+
+def run_session(pipeline, session, time_keystroke):
+    search_keys = get_search_keys(session)
+    latencies = list()
+    deadline = time.perf_counter() + SESSION_TIME_BUDGET_SECONDS
+    while not latencies or (len(latencies) < MIN_NR_KEYSTROKES_PER_SESSION and time.perf_counter() < deadline):
+        # The switcher empties the search key whenever it is shown
+        pipeline.update_search_key("")
+        for search_key in search_keys:
+            latencies.append(time_keystroke(pipeline, search_key))
+    return latencies
+
+
+def get_percentile(sorted_values, percentile):
+    index = max(0, math.ceil(percentile / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {'nr_keystrokes': len(latencies),
+            'p50_ms': 1000 * get_percentile(latencies, 50),
+            'p99_ms': 1000 * get_percentile(latencies, 99),
+            'max_ms': 1000 * latencies[-1],
+            'mean_ms': 1000 * sum(latencies) / len(latencies)}
+
+
+def measure_peak_memory(nr_titles):
+    """Peak memory of building the corpus and the pipeline, and typing every session once."""
+    tracemalloc.start()
+    pipeline = Pipeline(Corpus(nr_titles, random.Random(SEED)))
+    for session in SESSIONS.values():
+        pipeline.update_search_key("")
+        for search_key in get_search_keys(session):
+            pipeline.update_search_key(search_key)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes):
+    results = {'commit': get_commit(),
+               'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+               'python': platform.python_version(),
+               'scoring_engine': listfilter.get_scoring_engine_name(),
+               'latencies': list(),
+               'memory': list()}
+    print("{:>6} {:>13} {:>10} {:>10} {:>10} {:>10}".format("titles", "session", "stage", "p50 (ms)", "p99 (ms)",
+                                                           "max (ms)"))
+    for nr_titles in sizes:
+        pipeline = Pipeline(Corpus(nr_titles, random.Random(SEED)))
+        for session_name, session in SESSIONS.items():
+            for stage, time_keystroke in STAGES.items():
+                summary = summarize(run_session(pipeline, session, time_keystroke))
+                summary.update(nr_titles=nr_titles, session=session_name, stage=stage)
+                results['latencies'].append(summary)
+                print("{:>6} {:>13} {:>10} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+                    nr_titles, session_name, stage, summary['p50_ms'], summary['p99_ms'], summary['max_ms']))
+        peak = measure_peak_memory(nr_titles)
+        results['memory'].append({'nr_titles': nr_titles, 'peak_bytes': peak})
+        print("{:>6} peak memory: {:.1f} MB".format(nr_titles, peak / 2 ** 20))
+    return results
+
+
+def compare(results, baseline):
+    """Print the ratios of the latencies and memory to the ones of a baseline."""
+    print("Compared to {} (ratio > 1 is slower):".format(baseline.get('commit')))
+    baseline_latencies = {(entry['nr_titles'], entry['session'], entry['stage']): entry
+                          for entry in baseline['latencies']}
+    for entry in results['latencies']:
+        baseline_entry = baseline_latencies.get((entry['nr_titles'], entry['session'], entry['stage']))
+        if baseline_entry is None:
+            continue
+        print("{:>6} {:>13} {:>10}   p50 x{:.2f}   p99 x{:.2f}".format(
+            entry['nr_titles'], entry['session'], entry['stage'],
+            entry['p50_ms'] / max(baseline_entry['p50_ms'], 1e-9),
+            entry['p99_ms'] / max(baseline_entry['p99_ms'], 1e-9)))
+    baseline_memory = {entry['nr_titles']: entry['peak_bytes'] for entry in baseline['memory']}
+    for entry in results['memory']:
+        if entry['nr_titles'] in baseline_memory:
+            print("{:>6} peak memory x{:.2f}".format(entry['nr_titles'],
+                                                     entry['peak_bytes'] / max(baseline_memory[entry['nr_titles']], 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma separated numbers of window and tab titles")
+    parser.add_argument("--output", help="Save the results as JSON to this file")
+    parser.add_argument("--compare", help="Compare the results with the JSON results of another run")
+    args = parser.parse_args()
+    results = run([int(size) for size in args.sizes.split(',')])
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=1)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    main()
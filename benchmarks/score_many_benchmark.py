@@ -0,0 +1,56 @@
+"""Compare scoring candidates one at a time with ListFilter's batch scoring.
+
+Usage: python3 benchmarks/score_many_benchmark.py [NR_CANDIDATES ...]
+"""
+import os
+import sys
+import time
+import random
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import listfilter
+
+
+WORDS = ["github", "pull", "request", "issue", "inbox", "gmail", "calendar", "docs", "spreadsheet",
+         "stack", "overflow", "python", "linux", "kernel", "mailing", "list", "wikipedia", "news",
+         "youtube", "video", "terminal", "vim", "review", "dashboard", "grafana", "jira", "board",
+         "release", "notes", "build", "failed", "pipeline", "Mozilla", "Firefox", "Google", "Chrome"]
+TYPED_TEXT = "github pull"
+DEFAULT_NR_CANDIDATES = (10000, 50000)
+
+
+def generate_titles(nr_titles, seed=0):
+    randomizer = random.Random(seed)
+    return [" ".join(randomizer.choice(WORDS) for _ in range(randomizer.randint(2, 10)))
+            for _ in range(nr_titles)]
+
+
+def score_one_by_one(search_key, candidates):
+    return [listfilter.score_many(search_key, [candidate])[0] for candidate in candidates]
+
+
+def score_in_batch(search_key, candidates):
+    return listfilter.score_many(search_key, candidates, score_cutoff=listfilter.ListFilter.MIN_MATCH_SCORE)
+
+
+def measure(scoring_function, candidates):
+    start = time.perf_counter()
+    for nr_typed_chars in range(1, len(TYPED_TEXT) + 1):
+        search_key = listfilter.normalize(TYPED_TEXT[:nr_typed_chars])
+        scoring_function(search_key, candidates)
+    return (time.perf_counter() - start) / len(TYPED_TEXT)
+
+
+def main():
+    nr_candidates_list = [int(arg) for arg in sys.argv[1:]] or DEFAULT_NR_CANDIDATES
+    print("Scoring engine: {}".format(listfilter.get_scoring_engine_name()))
+    print("{:>12} {:>16} {:>16} {:>8}".format("candidates", "one-by-one (ms)", "batch (ms)", "speedup"))
+    for nr_candidates in nr_candidates_list:
+        candidates = [listfilter.normalize(title) for title in generate_titles(nr_candidates)]
+        one_by_one = measure(score_one_by_one, candidates)
+        batch = measure(score_in_batch, candidates)
+        print("{:>12} {:>16.1f} {:>16.1f} {:>7.1f}x".format(nr_candidates, one_by_one * 1000, batch * 1000,
+                                                           one_by_one / batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,144 +5,354 @@
 # than text, mode.
 
 import os
+import re
 import sys
 import json
 import time
-import errno
 import select
+import signal
+import socket
+import uuid
 import struct
-import traceback
+import collections
+import logging
+import logging.handlers
+
+import tabprotocol
+
+
+LOG_FILENAME_FORMAT = "/tmp/native-app-{}.log"
+LOG_FILENAME_PATTERN = re.compile(r"^native-app-(\d+)\.log(\.\d+)?$")
+# One of DEBUG, INFO, WARNING or ERROR. Routed messages are logged in DEBUG.
+LOG_LEVEL_ENV_VAR = "TEXTUAL_SWITCHER_PROXY_LOG_LEVEL"
+DEFAULT_LOG_LEVEL = "INFO"
+MAX_LOG_FILE_SIZE = 2 ** 20
+# Records are written once this many were buffered, or right away from WARNING on
+NR_BUFFERED_LOG_RECORDS = 64
+
+logger = logging.getLogger("api_proxy_native_app")
+
+
+def setup_logging():
+    _remove_logs_of_dead_proxies()
+    file_handler = logging.handlers.RotatingFileHandler(LOG_FILENAME_FORMAT.format(os.getpid()),
+                                                        maxBytes=MAX_LOG_FILE_SIZE, backupCount=1, delay=True)
+    file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s"))
+    handler = logging.handlers.MemoryHandler(NR_BUFFERED_LOG_RECORDS, flushLevel=logging.WARNING,
+                                             target=file_handler)
+    logger.addHandler(handler)
+    level = os.environ.get(LOG_LEVEL_ENV_VAR, DEFAULT_LOG_LEVEL).upper()
+    logger.setLevel(getattr(logging, level, logging.INFO))
+
+
+def _remove_logs_of_dead_proxies():
+    log_dir = os.path.dirname(LOG_FILENAME_FORMAT)
+    for filename in os.listdir(log_dir):
+        match = LOG_FILENAME_PATTERN.match(filename)
+        if match is None or _is_process_alive(int(match.group(1))):
+            continue
+        try:
+            os.unlink(os.path.join(log_dir, filename))
+        except OSError:
+            pass
 
 
-logfile = open("/tmp/native-app-{}.log".format(os.getpid()), "w")
-import time
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
 
 
-def log(msg):
-    logfile.write("{}: {}\n".format(time.ctime(), msg))
-    logfile.flush()
+class ProxyMetrics(object):
+    """Counters of the proxy's traffic, logged on SIGUSR1."""
+    def __init__(self):
+        # Direction -> [number of messages, number of bytes]
+        self.traffic = dict()
+        self.nr_routed_messages = 0
+        self.total_route_latency = 0.0
+        self.max_route_latency = 0.0
+        self.nr_reconnects = 0
+
+    def count_message(self, direction, nr_bytes):
+        self.count_traffic(direction, 1, nr_bytes)
+
+    def count_traffic(self, direction, nr_messages, nr_bytes):
+        counters = self.traffic.setdefault(direction, [0, 0])
+        counters[0] += nr_messages
+        counters[1] += nr_bytes
+
+    def count_route(self, latency):
+        self.nr_routed_messages += 1
+        self.total_route_latency += latency
+        self.max_route_latency = max(self.max_route_latency, latency)
+
+    def dump(self):
+        for direction, (nr_messages, nr_bytes) in sorted(self.traffic.items()):
+            logger.warning("metrics: %s: %d messages, %d bytes", direction, nr_messages, nr_bytes)
+        logger.warning("metrics: route latency: %.3f ms average, %.3f ms max over %d messages",
+                       1000 * self.total_route_latency / max(self.nr_routed_messages, 1),
+                       1000 * self.max_route_latency, self.nr_routed_messages)
+        logger.warning("metrics: %d reconnects of the switcher", self.nr_reconnects)
+
+
+metrics = ProxyMetrics()
+
+
+class WriteQueueFull(Exception): pass
+
+
+class WriteQueue(object):
+    """Data waiting to be written to a non blocking fd.
+
+    Writes go out right away as long as the reader keeps up. What the fd
+    does not take is queued, and written once the fd is writable again.
+    If `max_size` is given, the queue does not grow beyond it, except for
+    a single write to an empty queue.
+    """
+    def __init__(self, fd, max_size=None):
+        self.fd = fd
+        self.max_size = max_size
+        self._chunks = collections.deque()
+        self._size = 0
+        # Bytes of the first chunk that were already written
+        self._offset = 0
+
+    def is_empty(self):
+        return not self._chunks
+
+    def write(self, data):
+        """Raises WriteQueueFull if the queue would grow beyond its maximal size. The queued data
+        is then dropped, except for a chunk that was partly written already."""
+        if self.max_size is not None and self._chunks and self._size + len(data) > self.max_size:
+            self._drop_unwritten_chunks()
+            raise WriteQueueFull()
+        self._chunks.append(data)
+        self._size += len(data)
+        self.flush()
+
+    def _drop_unwritten_chunks(self):
+        # The rest of a partly written chunk must follow, or the reader would lose the framing
+        first_chunk = self._chunks[0] if self._offset else None
+        self._chunks.clear()
+        self._size = 0
+        if first_chunk is not None:
+            self._chunks.append(first_chunk)
+            self._size = len(first_chunk)
+
+    def flush(self):
+        """Write as much as the fd takes. Raises BrokenPipeError if the reader is gone."""
+        while self._chunks:
+            chunk = self._chunks[0]
+            try:
+                nr_bytes = os.write(self.fd, memoryview(chunk)[self._offset:])
+            except BlockingIOError:
+                return
+            self._offset += nr_bytes
+            if self._offset == len(chunk):
+                self._chunks.popleft()
+                self._size -= len(chunk)
+                self._offset = 0
 
 
 class ExtensionMessages(object):
+    """Native messages: a length in native byte order, followed by JSON."""
+    LENGTH = struct.Struct('@I')
+    READ_SIZE = 2 ** 20
+
+    def __init__(self):
+        self._data = bytearray()
+        os.set_blocking(self.in_fd(), False)
+        os.set_blocking(sys.stdout.fileno(), False)
+        self.write_queue = WriteQueue(sys.stdout.fileno())
+
     @staticmethod
     def in_fd():
         return sys.stdin.fileno()
 
-    # Encode a message for transmission, given its content.
-    @staticmethod
-    def _encode_message(msg_bytes):
-        msg_str = msg_bytes.decode('utf-8')
-        encoded_content = json.dumps(msg_str)
-        encoded_length = struct.pack('@I', len(encoded_content))
-        return {'length': encoded_length, 'content': encoded_content}
-
-    # Send a message to stdout.
-    @classmethod
-    def send_message(cls, message):
-        log("sending to app over pipe: {} bytes".format(len(message)))
-        messaegs = message.split(b';')
-        for msg_bytes in messaegs:
-            msg_dict = cls._encode_message(msg_bytes)
-            sys.stdout.buffer.write(msg_dict['length'])
-            sys.stdout.write(msg_dict['content'])
-            sys.stdout.flush()
-
-
-class SwitcherMessages(object):
-    UID = os.getuid()
-    FIFO_PATH_DIR = os.path.join("/run", "user", str(UID), "textual-switcher-proxy")
-    PPID = os.getppid()
-    IN_FIFO_FILENAME = "textual_switcher_to_api_proxy_for_firefox_pid_%d" % (PPID,)
-    OUT_FIFO_FILENAME = "api_proxy_to_textual_switcher_for_firefox_pid_%d" % (PPID,)
-
-    def __init__(self):
-        self._validate_fifo_dir_exists()
-        self._in_fifo_filename = os.path.join(self.FIFO_PATH_DIR, self.IN_FIFO_FILENAME)
-        self._out_fifo_filename = os.path.join(self.FIFO_PATH_DIR, self.OUT_FIFO_FILENAME)
-        self._in_fifo = None
-        self._connect()
-
-    def get_message(self):
-        data = os.read(self._in_fifo, 2 ** 20)
-        if len(data) == 0:
-            # Writer closed
-            return None
-        return data
-
-    def send_message(self, message):
-        log("sending to switcher over pipe: {} bytes".format(len(message)))
+    def get_messages(self):
+        """Read everything that is available. Returns the complete messages, and
+        whether the browser is still connected."""
+        is_connected = True
+        while True:
+            try:
+                data = os.read(self.in_fd(), self.READ_SIZE)
+            except BlockingIOError:
+                break
+            if len(data) == 0:
+                # The browser closed the pipe
+                is_connected = False
+                break
+            self._data += data
+        messages = list()
+        offset = 0
+        while len(self._data) - offset >= self.LENGTH.size:
+            length = self.LENGTH.unpack_from(self._data, offset)[0]
+            message_start = offset + self.LENGTH.size
+            if len(self._data) < message_start + length:
+                break
+            try:
+                messages.append(json.loads(str(memoryview(self._data)[message_start:message_start + length],
+                                               'utf-8')))
+            except ValueError:
+                logger.warning("cannot decode message of %d bytes from the extension", length)
+            metrics.count_message("from extension", length)
+            offset = message_start + length
+        # Partial messages are kept until the rest of them is read
+        del self._data[:offset]
+        return messages, is_connected
+
+    # Send a command to the extension through stdout.
+    def send_message(self, command):
+        logger.debug("sending to extension: %s", command)
+        content = json.dumps(command).encode('utf-8')
+        metrics.count_message("to extension", len(content))
+        self.write_queue.write(self.LENGTH.pack(len(content)) + content)
+
+
+def get_ancestor_pids():
+    """The PIDs of the proxy's ancestors, nearest first, up to its session leader.
+
+    The browser that launched the proxy may not be its parent, for instance
+    when the proxy is run by a launcher of the browser.
+    """
+    pids = [os.getppid()]
+    while pids[-1] > 1:
         try:
-            nr_bytes = os.write(self._out_fifo, message)
-        except OSError as ex:
-            if ex.errno == 32:
-                raise DisconnectionException()
-            else:
-                log("cannot write to switcher, broken pipe (probably disconnected)")
-                raise
+            with open("/proc/{}/stat".format(pids[-1])) as stat_file:
+                stat = stat_file.read()
+        except OSError:
+            break
+        # The command name may contain spaces and parentheses
+        _, ppid, _, session = stat[stat.rindex(')') + 2:].split()[:4]
+        if int(session) == pids[-1] or int(ppid) <= 1:
+            break
+        pids.append(int(ppid))
+    return pids
+
+
+class SwitcherConnection(object):
+    """A connection to the broker socket of the switcher.
+
+    The switcher may not be running, or may restart, so the connection is
+    made again whenever it is lost.
+    """
+    # Pushed deltas pile up while the switcher does not read them. Beyond
+    # this, they are dropped, and the switcher is sent a snapshot instead.
+    MAX_WRITE_QUEUE_SIZE = 2 ** 24
 
-    def in_fd(self):
-        return self._in_fifo
+    def __init__(self):
+        self._socket = None
+        self._reader = None
+        self.write_queue = None
 
-    def reconnect(self):
-        self.cleanup()
-        self._connect()
+    def is_connected(self):
+        return self._socket is not None
 
-    def _connect(self):
-        self._in_fifo = self._open_in_fifo()
+    def connect(self):
+        """Returns whether the switcher accepted the connection."""
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         try:
-            self._out_fifo = self._open_out_fifo()
-        except:
-            self.cleanup()
-            raise
-
-    def _validate_fifo_dir_exists(self):
+            connection.connect(tabprotocol.BROKER_SOCKET_PATH)
+        except OSError as ex:
+            logger.debug("cannot connect to switcher: %s", ex)
+            connection.close()
+            return False
+        connection.setblocking(False)
+        self._socket = connection
+        self._reader = tabprotocol.FramedReader(connection.fileno())
+        self.write_queue = WriteQueue(connection.fileno(), self.MAX_WRITE_QUEUE_SIZE)
         try:
-            os.makedirs(self.FIFO_PATH_DIR)
+            self.send_message(tabprotocol.register_op(os.getppid(), get_ancestor_pids()))
         except OSError as ex:
-            if ex.errno != errno.EEXIST:
-                raise
-
-    def _open_in_fifo(self):
-        self._create_fifo(self._in_fifo_filename)
-        fd = os.open(self._in_fifo_filename, os.O_RDONLY | os.O_NONBLOCK)
-        return fd
+            # The switcher exited right after accepting
+            logger.debug("cannot register with switcher: %s", ex)
+            self.disconnect()
+            return False
+        return True
+
+    def disconnect(self):
+        self._socket.close()
+        self._socket = None
+        self._reader = None
+        self.write_queue = None
 
-    def _open_out_fifo(self):
-        self._create_fifo(self._out_fifo_filename)
-        fd = os.open(self._out_fifo_filename, os.O_WRONLY)
-        return fd
+    def in_fd(self):
+        return self._socket.fileno()
 
-    @staticmethod
-    def _create_fifo(fifo_path):
-        log(f'Creating out FIFO in "{fifo_path}"')
+    def get_messages(self):
+        """Read everything that is available. Returns the complete messages, and
+        whether the switcher is still connected."""
+        nr_bytes_read = self._reader.nr_bytes_read
         try:
-            os.mkfifo(fifo_path)
-        except OSError as ex:
-            if ex.errno != errno.EEXIST:
-                raise
+            # False once the switcher closed, after the rest of the data was read
+            is_connected = self._reader.read()
+        except ConnectionResetError:
+            is_connected = False
+        messages = list()
+        while True:
+            try:
+                message = self._reader.pop_message()
+            except tabprotocol.ProtocolError as ex:
+                logger.warning("dropping message from switcher: %s", ex)
+                continue
+            if message is None:
+                break
+            messages.append(message)
+        metrics.count_traffic("from switcher", len(messages), self._reader.nr_bytes_read - nr_bytes_read)
+        return messages, is_connected
+
+    def send_message(self, message):
+        frame = tabprotocol.encode_frame(message, tabprotocol.ENCODING_MARSHAL)
+        logger.debug("sending to switcher: %d bytes", len(frame))
+        metrics.count_message("to switcher", len(frame))
+        self.write_queue.write(frame)
 
-    def cleanup(self):
-        try:
-            os.close(self._in_fifo)
-        except:
-            pass
-        try:
-            os.close(self._out_fifo)
-        except:
-            pass
-        try:
-            os.unlink(self._in_fifo_filename)
-        except:
-            pass
-        try:
-            os.unlink(self._out_fifo_filename)
-        except:
-            pass
 
 class Message(object):
-    def __init__(self, content, source):
+    def __init__(self, content, source, read_time):
         self.content = content
         self.source = source
+        self.read_time = read_time
+
+
+class BrowserTabs(object):
+    """The versioned tab table of the browser, kept up to date by its extension."""
+    def __init__(self):
+        self.table = tabprotocol.TabTable(epoch=uuid.uuid4().hex)
+        # Whether the extension pushes tab changes. Older extensions only
+        # send all the tabs when asked to.
+        self.is_live = False
+
+    def handle_extension_message(self, message):
+        """Apply a message from the extension. Returns the ids of the tabs that changed."""
+        if isinstance(message, list):
+            return self.table.set_tabs(message)
+        if not isinstance(message, dict):
+            logger.warning("unknown message from the extension: %s", message)
+            return []
+        event = message.get('event')
+        self.is_live = True
+        if event == 'snapshot':
+            return self.table.set_tabs(message['tabs'])
+        elif event == 'updated':
+            tab = message['tab']
+            return [tab['id']] if self.table.update_tab(tab) else []
+        elif event == 'removed':
+            return [message['tabId']] if self.table.remove_tab(message['tabId']) else []
+        elif event == 'activated':
+            changed_tab_ids = list()
+            for tab in list(self.table.tabs.values()):
+                is_active = tab['id'] == message['tabId']
+                if tab.get('windowId') == message['windowId'] and tab.get('active') != is_active:
+                    if self.table.update_tab(dict(tab, active=is_active)):
+                        changed_tab_ids.append(tab['id'])
+            return changed_tab_ids
+        logger.warning("unknown event from the extension: %s", event)
+        return []
 
 
 class DisconnectionEvent:
@@ -157,88 +367,235 @@ class DisconnectionException(Exception):
 
 
 class PointToPointPipesSwitch(object):
-    def __init__(self, a, b):
-        self._sides = dict(a=a, b=b)
+    """Connects the extension to the switcher.
+
+    Tab changes from the extension are applied to the browser's tab table
+    and pushed to the switcher as deltas, once the switcher synced with it.
+    While the switcher is not connected, the extension is still served, and
+    connecting to the switcher is retried every few seconds.
+
+    Both sides are read and written without blocking. Writes that a side
+    does not take right away are queued, and the side's fd is watched for
+    EPOLLOUT until its queue is drained, so a slow reader on one side never
+    stops the proxy from reading the other side.
+    """
+    CONNECTION_RETRY_INTERVAL = 2
+
+    def __init__(self, extension, switcher, browser_tabs, signal_fd):
+        self._extension = extension
+        self._switcher = switcher
+        self._browser_tabs = browser_tabs
+        # Readable when a signal was received, see signal.set_wakeup_fd
+        self._signal_fd = signal_fd
+        # The version of the tab table that the switcher has
+        self._switcher_version = None
+        # Set once changes were dropped since the switcher did not read them
+        self._must_send_snapshot = False
+        self._next_connection_time = 0
+        self._was_switcher_connected = False
         self._epoll = select.epoll()
-        self._epoll.register(self._sides['a'].in_fd())
-        self._epoll.register(self._sides['b'].in_fd())
+        # Fd -> the events it is registered for. The switcher's socket is
+        # both read and written, so its events are combined.
+        self._watched_events = dict()
 
     def run(self):
+        """Route messages until the extension disconnects."""
         while True:
-            while True:
-                try:
-                    events = self._wait_for_events()
-                except IOError as ex:
-                    if ex.errno == 4:
-                        log("interrupted poll. will retry again in 5 seconds...")
-                        time.sleep(5)
-                        continue
-                    else:
-                        raise ex
-                break
-            for event in events:
+            if not self._switcher.is_connected() and time.monotonic() >= self._next_connection_time:
+                self._connect_switcher()
+            self._update_watched_events()
+            if self._switcher.is_connected():
+                timeout = -1
+            else:
+                timeout = max(self._next_connection_time - time.monotonic(), 0)
+            for event in self._wait_for_events(timeout):
                 if isinstance(event, DisconnectionEvent):
-                    raise DisconnectionException(event.side)
+                    if event.side is self._extension:
+                        raise DisconnectionException(event.side)
+                    self._disconnect_switcher()
                 elif isinstance(event, Message):
                     self._route_message(event)
                 else:
                     assert False
 
+    def close(self):
+        self._epoll.close()
+
+    def _connect_switcher(self):
+        if not self._switcher.connect():
+            self._next_connection_time = time.monotonic() + self.CONNECTION_RETRY_INTERVAL
+            return
+        logger.info("Connected to switcher")
+        if self._was_switcher_connected:
+            metrics.nr_reconnects += 1
+        self._was_switcher_connected = True
+
+    def _disconnect_switcher(self):
+        if not self._switcher.is_connected():
+            return
+        logger.info("Switcher disconnected")
+        # Closing the socket would remove it from the epoll, but not from the watched fds
+        self._unwatch(self._switcher.in_fd())
+        self._switcher.disconnect()
+        self._switcher_version = None
+        self._must_send_snapshot = False
+        self._next_connection_time = time.monotonic() + self.CONNECTION_RETRY_INTERVAL
+
     def _route_message(self, message):
-        destination = self._sides['b'] if message.source == self._sides['a'] else self._sides['a']
+        if message.source is self._extension:
+            self._handle_extension_message(message.content)
+        elif self._switcher.is_connected():
+            self._handle_switcher_message(message.content)
+        metrics.count_route(time.perf_counter() - message.read_time)
+
+    def _handle_extension_message(self, message):
+        table = self._browser_tabs.table
+        version = table.version
+        changed_tab_ids = self._browser_tabs.handle_extension_message(message)
+        # Every change is pushed once the switcher synced, so only the tabs
+        # of this message changed since the switcher's version
+        if changed_tab_ids and self._switcher_version == version:
+            self._send_to_switcher(table.get_changes_of(version, changed_tab_ids))
+
+    def _handle_switcher_message(self, message):
+        op = message.get('op')
+        if op == tabprotocol.OP_SYNC:
+            self._send_changes_to_switcher(message.get('epoch'), message.get('since'), message.get('id'))
+            if not self._browser_tabs.is_live:
+                self._send_to_extension("list_tabs")
+        elif op == tabprotocol.OP_MOVE_TO_TAB:
+            self._send_to_extension("move_to_tab:{}".format(message['tab_id']))
+        else:
+            logger.warning("unknown op from switcher: %s", op)
+
+    def _send_changes_to_switcher(self, epoch, since, request_id=None):
+        if self._must_send_snapshot:
+            since = None
+        changes = self._browser_tabs.table.get_changes_since(epoch, since)
+        if request_id is not None:
+            changes['id'] = request_id
+        self._send_to_switcher(changes)
+
+    def _send_to_switcher(self, changes):
         try:
-            destination.send_message(message.content)
-        except DisconnectionException:
-            raise DisconnectionException(side=destination)
+            self._switcher.send_message(changes)
+        except WriteQueueFull:
+            # Changes are no longer pushed, and the switcher gets a snapshot once it syncs again
+            logger.warning("switcher is not reading, dropped the changes queued for it")
+            self._switcher_version = None
+            self._must_send_snapshot = True
+            return
+        except OSError:
+            self._disconnect_switcher()
+            return
+        self._switcher_version = self._browser_tabs.table.version
+        self._must_send_snapshot = False
+
+    def _send_to_extension(self, command):
+        try:
+            self._extension.send_message(command)
+        except (IOError, OSError):
+            raise DisconnectionException(side=self._extension)
+
+    def _get_connected_sides(self):
+        if self._switcher.is_connected():
+            return (self._extension, self._switcher)
+        return (self._extension,)
 
-    def _wait_for_events(self):
+    def _wait_for_events(self, timeout):
         events = list()
-        for fd, event_type in self._epoll.poll():
-            source = self._sides['a'] if fd == self._sides['a'].in_fd() else self._sides['b']
-            if event_type in (select.EPOLLIN, select.EPOLLRDNORM):
-                content = os.read(fd, 2 ** 20)
-                message = Message(content=content, source=source)
-                events.append(message)
-            elif event_type == select.EPOLLHUP:
-                events.append(DisconnectionEvent(side=source))
-            else:
+        for fd, event_type in self._epoll.poll(timeout):
+            if fd == self._signal_fd:
+                self._handle_signals()
                 continue
+            for side in self._get_connected_sides():
+                if fd == side.write_queue.fd and not side.write_queue.is_empty():
+                    try:
+                        side.write_queue.flush()
+                    except OSError:
+                        events.append(DisconnectionEvent(side=side))
+                        continue
+                if fd != side.in_fd():
+                    continue
+                if event_type & select.EPOLLIN:
+                    # Read before handling a hang up in the same event, since the
+                    # last messages of the other side may still be unread
+                    messages, is_connected = side.get_messages()
+                    read_time = time.perf_counter()
+                    events.extend(Message(content=content, source=side, read_time=read_time)
+                                  for content in messages)
+                    if not is_connected:
+                        events.append(DisconnectionEvent(side=side))
+                elif event_type & (select.EPOLLHUP | select.EPOLLERR):
+                    events.append(DisconnectionEvent(side=side))
 
         return events
 
+    def _update_watched_events(self):
+        """Watch the sides for reading, and for writing while their write queues are not empty."""
+        events = {self._signal_fd: select.EPOLLIN}
+        for side in self._get_connected_sides():
+            events[side.in_fd()] = events.get(side.in_fd(), 0) | select.EPOLLIN
+            if not side.write_queue.is_empty():
+                events[side.write_queue.fd] = events.get(side.write_queue.fd, 0) | select.EPOLLOUT
+        for fd in [fd for fd in self._watched_events if fd not in events]:
+            self._unwatch(fd)
+        for fd, event_mask in events.items():
+            if fd not in self._watched_events:
+                self._epoll.register(fd, event_mask)
+            elif self._watched_events[fd] != event_mask:
+                self._epoll.modify(fd, event_mask)
+            self._watched_events[fd] = event_mask
+
+    def _unwatch(self, fd):
+        if self._watched_events.pop(fd, None) is not None:
+            self._epoll.unregister(fd)
+
+    def _handle_signals(self):
+        try:
+            signal_numbers = os.read(self._signal_fd, 1024)
+        except BlockingIOError:
+            return
+        if signal.SIGUSR1 in signal_numbers:
+            metrics.dump()
+
+
+def create_signal_fd():
+    """Return an fd that is readable once SIGUSR1 (dump the metrics) is received."""
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.set_blocking(write_fd, False)
+    signal.set_wakeup_fd(write_fd)
+    # The handler itself does nothing, the signal is handled from the main loop
+    signal.signal(signal.SIGUSR1, lambda signal_number, frame: None)
+    return read_fd
+
 
 def main():
-    log("Starting...")
+    setup_logging()
+    logger.info("Starting...")
+    signal_fd = create_signal_fd()
     extension_messages = ExtensionMessages()
-    switcher_messages = SwitcherMessages()
-    messageSwitch = PointToPointPipesSwitch(a=extension_messages, b=switcher_messages)
-    run_another_iteration = True
-    while run_another_iteration:
-        log("Running another iteration")
-        run_another_iteration = False
-        try:
-            messageSwitch.run()
-        except DisconnectionException as ex:
-            log("Disconnected. Handling...")
-            if ex.side == switcher_messages:
-                log("Switcher disconnected. Reconnecting...")
-                ex.side.reconnect()
-                log("Reconnected.")
-                messageSwitch = PointToPointPipesSwitch(a=extension_messages, b=switcher_messages)
-                run_another_iteration = True
-        except Exception as ex:
-            log("Exception: {}".format(ex))
-            tb = "".join(traceback.format_exc())
-            log(tb)
-        finally:
-            log("Cleaning up...")
-            if not run_another_iteration:
-                switcher_messages.cleanup()
-            log("Clean up done.")
+    switcher_connection = SwitcherConnection()
+    # Kept across reconnections of the switcher
+    browser_tabs = BrowserTabs()
+    message_switch = PointToPointPipesSwitch(extension_messages, switcher_connection, browser_tabs, signal_fd)
+    try:
+        message_switch.run()
+    except DisconnectionException:
+        logger.info("Extension disconnected")
+    except Exception:
+        logger.exception("Exception:")
+    finally:
+        message_switch.close()
+        if switcher_connection.is_connected():
+            switcher_connection.disconnect()
 
 
 if __name__ == "__main__":
     try:
         main()
-    except Exception as ex:
-        log("Exception while reconnecting: {}".format(ex))
+    except Exception:
+        logger.exception("Exception:")
+    finally:
+        logging.shutdown()
@@ -5,6 +5,49 @@ console.log('starting proxy...')
 var port = chrome.runtime.connectNative("api_proxy_native_app");
 console.log('proxy is up.')
 
+/*
+Only the keys of tabs that are interesting to the switcher are sent
+*/
+function summarizeTab(tab) {
+  return {title: tab['title'],
+          id: tab['id'],
+          url: tab['url'],
+          favIconUrl: tab['favIconUrl'],
+          windowId: tab['windowId'],
+          active: tab['active']
+         };
+}
+
+function sendSnapshot() {
+  chrome.tabs.query({},
+    function(result) {
+      console.log('Sending tab list');
+      port.postMessage({event: "snapshot", tabs: result.map(summarizeTab)});
+    });
+}
+
+/*
+Push tab changes to the API proxy as they happen, so the switcher can keep a
+live copy of the tab list instead of asking for all of it on every activation.
+*/
+chrome.tabs.onCreated.addListener((tab) => {
+  port.postMessage({event: "updated", tab: summarizeTab(tab)});
+});
+
+chrome.tabs.onUpdated.addListener((tabId, changeInfo, tab) => {
+  if ('title' in changeInfo || 'url' in changeInfo || 'favIconUrl' in changeInfo) {
+    port.postMessage({event: "updated", tab: summarizeTab(tab)});
+  }
+});
+
+chrome.tabs.onRemoved.addListener((tabId, removeInfo) => {
+  port.postMessage({event: "removed", tabId: tabId});
+});
+
+chrome.tabs.onActivated.addListener((activeInfo) => {
+  port.postMessage({event: "activated", tabId: activeInfo.tabId, windowId: activeInfo.windowId});
+});
+
 /*
 Listen (and respond) to messages from the API proxy.
 */
@@ -12,21 +55,7 @@ port.onMessage.addListener((message) => {
   console.log("Received from API proxy: " + message);
 
   if (message == "list_tabs") {
-    // List tabs
-    tabs = null
-    chrome.tabs.query({},
-      function(result) {
-        // Filter results to interesting keys
-        tabs = result.map(function(tab) {
-                            return {title: tab['title'],
-                                    id: tab['id'],
-                                    url: tab['url'],
-                                    favIconUrl: tab['favIconUrl']
-                                   };
-                          });
-        console.log('Sending tab list');
-        port.postMessage(tabs);
-      });
+    sendSnapshot();
 
   } else if (message.startsWith("move_to_tab:")) {
     tabId = parseInt(message.substring("move_to_tab:".length));
@@ -34,3 +63,6 @@ port.onMessage.addListener((message) => {
     chrome.tabs.update(tabId, {active: true});
   }
 });
+
+// Send a full snapshot on (re)connection, changes are pushed afterwards
+sendSnapshot();
@@ -1,3 +1,4 @@
+import collections
 from gi.repository import GLib, Gio
 
 
@@ -33,25 +34,150 @@ def async_run_subprocess(command):
                          flags=GLib.SpawnFlags.SEARCH_PATH | GLib.SpawnFlags.DO_NOT_REAP_CHILD,
                          standard_output=True,
                          standard_error=True)
+    GLib.child_watch_add(GLib.PRIORITY_DEFAULT, pid, lambda pid, status: GLib.spawn_close_pid(pid))
     return stdout
 
 
-def async_get_url(url, on_ready_callback):
+class UrlFetchScheduler(object):
+    """Fetches URLs with Gio, a few at a time.
 
-    cancellable = Gio.Cancellable()
+    Requests for a URL that is already queued or being fetched are merged.
+    Every fetch has a timeout, and failed fetches are retried with an
+    exponential backoff. `on_ready_callback(url, contents, etag)` is called
+    for fetched URLs, and `on_failed_callback(url)` once a URL's retries
+    are exhausted.
+    """
+    MAX_NR_CONCURRENT_FETCHES = 6
+    FETCH_TIMEOUT_MS = 10000
+    MAX_NR_RETRIES = 3
+    FIRST_RETRY_DELAY_MS = 1000
 
-    def on_icon_ready_callback_wrapper(source_object, result, url):
+    def __init__(self, on_ready_callback, on_failed_callback):
+        self._on_ready_callback = on_ready_callback
+        self._on_failed_callback = on_failed_callback
+        # URL -> the number of failed attempts, in the order of the requests
+        self._queue = collections.OrderedDict()
+        # URL -> (cancellable, timeout source ID)
+        self._in_flight = dict()
+        # URL -> retry timer source ID
+        self._retries = dict()
+
+    def fetch(self, url):
+        if url in self._queue or url in self._in_flight or url in self._retries:
+            return
+        self._queue[url] = 0
+        self._start_fetches()
+
+    def cancel_all(self):
+        """Drop all queued fetches and cancel the running ones. Returns their URLs."""
+        urls = list(self._queue) + list(self._in_flight) + list(self._retries)
+        self._queue.clear()
+        for cancellable, timeout_source_id in self._in_flight.values():
+            if timeout_source_id is not None:
+                GLib.source_remove(timeout_source_id)
+            cancellable.cancel()
+        self._in_flight.clear()
+        for retry_source_id in self._retries.values():
+            GLib.source_remove(retry_source_id)
+        self._retries.clear()
+        return urls
+
+    def _start_fetches(self):
+        while self._queue and len(self._in_flight) < self.MAX_NR_CONCURRENT_FETCHES:
+            url, nr_failures = self._queue.popitem(last=False)
+            cancellable = Gio.Cancellable()
+            timeout_source_id = GLib.timeout_add(self.FETCH_TIMEOUT_MS, self._fetch_timed_out, url)
+            self._in_flight[url] = (cancellable, timeout_source_id)
+            Gio.File.new_for_uri(url).load_contents_async(cancellable, self._fetch_done_callback,
+                                                          (url, nr_failures, cancellable))
+
+    def _fetch_timed_out(self, url):
+        cancellable, _ = self._in_flight[url]
+        # Leave the entry, so that the cancelled fetch counts as failed
+        self._in_flight[url] = (cancellable, None)
+        cancellable.cancel()
+        return False
+
+    def _fetch_done_callback(self, source_object, result, user_data):
+        url, nr_failures, cancellable = user_data
+        entry = self._in_flight.get(url)
         try:
             success, contents, etag = source_object.load_contents_finish(result)
         except GLib.GError as e:
-            print("Error loading URL '%s': %s" % (url, e.message))
+            success, contents, etag = False, None, None
+            error_message = e.message
         else:
-            if success:
-                on_ready_callback(url, contents)
-            else:
-                print("Error reading icon")
-        finally:
-            cancellable.reset()
-
-    file_ = Gio.File.new_for_uri(url)
-    file_.load_contents_async(cancellable, on_icon_ready_callback_wrapper, url)
+            error_message = "no contents"
+        if entry is None or entry[0] is not cancellable:
+            # Cancelled by cancel_all
+            return
+        del self._in_flight[url]
+        if entry[1] is not None:
+            GLib.source_remove(entry[1])
+
+        if success:
+            self._on_ready_callback(url, contents, etag)
+        elif nr_failures < self.MAX_NR_RETRIES:
+            delay_ms = self.FIRST_RETRY_DELAY_MS * 2 ** nr_failures
+            self._retries[url] = GLib.timeout_add(delay_ms, self._retry, url, nr_failures + 1)
+        else:
+            print("Error loading URL '%s': %s" % (url, error_message))
+            self._on_failed_callback(url)
+        self._start_fetches()
+
+    def _retry(self, url, nr_failures):
+        del self._retries[url]
+        self._queue[url] = nr_failures
+        self._start_fetches()
+        return False
+
+
+class CoalescingScheduler(object):
+    """Runs a callback once for all the requests made within one main loop iteration.
+
+    The callback runs from an idle source whose priority is just above GTK's
+    redraw, i.e. after pending IO events were dispatched but before the next
+    frame is drawn. If the main loop is kept busy, it runs anyway once
+    `max_latency_ms` have passed since the first pending request.
+    """
+    PRIORITY = GLib.PRIORITY_HIGH_IDLE + 15
+
+    def __init__(self, callback, max_latency_ms=50):
+        self._callback = callback
+        self._max_latency_ms = max_latency_ms
+        self._idle_source_id = None
+        self._timeout_source_id = None
+        self.nr_requested = 0
+        self.nr_executed = 0
+
+    def schedule(self):
+        self.nr_requested += 1
+        if self._idle_source_id is None:
+            self._idle_source_id = GLib.idle_add(self._run_from_idle, priority=self.PRIORITY)
+            self._timeout_source_id = GLib.timeout_add(self._max_latency_ms, self._run_from_timeout)
+
+    def is_pending(self):
+        return self._idle_source_id is not None
+
+    def flush(self):
+        """Run the callback now if there are pending requests."""
+        if self.is_pending():
+            GLib.source_remove(self._idle_source_id)
+            GLib.source_remove(self._timeout_source_id)
+            self._run()
+
+    def _run_from_idle(self):
+        GLib.source_remove(self._timeout_source_id)
+        self._run()
+        return False
+
+    def _run_from_timeout(self):
+        GLib.source_remove(self._idle_source_id)
+        self._run()
+        return False
+
+    def _run(self):
+        self._idle_source_id = None
+        self._timeout_source_id = None
+        self.nr_executed += 1
+        self._callback()
@@ -0,0 +1,247 @@
+import os
+import time
+import weakref
+import hashlib
+import threading
+import gi
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GLib
+from gi.repository.GdkPixbuf import InterpType, Pixbuf, PixbufLoader
+
+
+class ScaledIconCache(object):
+    """Scaled copies of window icons and tab favicons.
+
+    Entries are keyed by (source key, size), where the source key is a window
+    XID or a favicon URL. A source image is scaled once, and is scaled again
+    only if the source pixbuf itself is replaced. Sources that are shared
+    by several keys (see IconInterner) are scaled once for all of them.
+    """
+    def __init__(self, interner=None):
+        self._entries = dict()
+        self._interner = interner
+
+    def get(self, source_key, source, size):
+        if source is None:
+            return None
+        entry = self._entries.get((source_key, size))
+        if entry is not None and entry[0] is source:
+            return entry[1]
+        scaled = self._get_scaled_copy(source, size)
+        self._entries[(source_key, size)] = (source, scaled)
+        return scaled
+
+    def _get_scaled_copy(self, source, size):
+        for entry_source, scaled in self._entries.values():
+            if entry_source is source and scaled.get_width() == size:
+                return scaled
+        scaled = scale_icon(source, size)
+        if self._interner is not None:
+            scaled = self._interner.intern(scaled)
+        return scaled
+
+    def get_icons(self):
+        return [scaled for _, scaled in self._entries.values()]
+
+    def retain(self, source_keys):
+        """Evict the icons of sources (windows or tabs) that are not in `source_keys`."""
+        stale_keys = [key for key in self._entries if key[0] not in source_keys]
+        for key in stale_keys:
+            del self._entries[key]
+
+
+class IconInterner(object):
+    """Shares one pixbuf between icons with identical images.
+
+    Icons are keyed by a hash of their pixels, so the favicons of all the
+    pages of a site, or the icons of all the windows of an application, are
+    held once. Interning a pixbuf that was interned before only costs a
+    lookup by its identity. Duplicates are only referenced weakly, so they
+    are freed once their owner drops them for the shared icon.
+    """
+    def __init__(self):
+        # Pixels hash -> the shared icon
+        self._icons = dict()
+        self._shared_icon_ids = set()
+        # Identity of a duplicate pixbuf -> (weak reference to it, its shared icon)
+        self._duplicates = dict()
+        self.nr_duplicates = 0
+        self.nr_released_bytes = 0
+
+    def intern(self, icon, is_held_elsewhere=False):
+        """Return the shared icon with the same image as `icon`.
+
+        `is_held_elsewhere` tells that `icon` stays referenced by its owner
+        (e.g. Wnck's window icons), so sharing it saves scaling it again but
+        releases no memory.
+        """
+        if icon is None:
+            return None
+        if id(icon) in self._shared_icon_ids:
+            return icon
+        entry = self._duplicates.get(id(icon))
+        if entry is not None and entry[0]() is icon:
+            return entry[1]
+        key = self._get_key(icon)
+        shared_icon = self._icons.setdefault(key, icon)
+        if shared_icon is icon:
+            self._shared_icon_ids.add(id(icon))
+            return icon
+        self.nr_duplicates += 1
+        if not is_held_elsewhere:
+            self.nr_released_bytes += icon.get_byte_length()
+        self._duplicates[id(icon)] = (weakref.ref(icon), shared_icon)
+        return shared_icon
+
+    @staticmethod
+    def _get_key(icon):
+        pixels = icon.read_pixel_bytes().get_data()
+        return (icon.get_width(), icon.get_height(), icon.get_rowstride(), icon.get_n_channels(),
+                icon.get_has_alpha(), hashlib.blake2b(pixels, digest_size=16).digest())
+
+    def retain(self, icons):
+        """Forget the icons that are not in `icons`, which are still in use."""
+        icon_ids = set(id(icon) for icon in icons)
+        self._icons = {key: icon for key, icon in self._icons.items() if id(icon) in icon_ids}
+        self._shared_icon_ids = set(id(icon) for icon in self._icons.values())
+        self._duplicates = {icon_id: entry for icon_id, entry in self._duplicates.items()
+                            if entry[0]() is not None and id(entry[1]) in self._shared_icon_ids}
+
+    def get_stats(self):
+        nr_bytes = sum(icon.get_byte_length() for icon in self._icons.values())
+        return ("Icons: {} distinct ({:.1f} KB), {} duplicates shared, releasing {:.1f} KB".format(
+            len(self._icons), nr_bytes / 1024.0, self.nr_duplicates, self.nr_released_bytes / 1024.0))
+
+
+def scale_icon(icon, size):
+    if icon.get_width() == size and icon.get_height() == size:
+        return icon
+    return icon.scale_simple(size, size, InterpType.BILINEAR)
+
+
+def decode_icon(contents, size):
+    """Decode an image straight to size x size pixels.
+
+    Loaders that support it (e.g. SVG, or ICO files holding several sizes)
+    decode at the requested size instead of decoding the full image and
+    scaling it down. Can be called from any thread.
+    """
+    def size_prepared_callback(loader, width, height):
+        if (width, height) != (size, size):
+            loader.set_size(size, size)
+
+    loader = PixbufLoader()
+    loader.connect('size-prepared', size_prepared_callback)
+    try:
+        loader.write(contents)
+    finally:
+        loader.close()
+    return scale_icon(loader.get_pixbuf(), size)
+
+
+class FaviconDiskCache(object):
+    """Scaled favicons, kept as PNG files under the user's cache directory.
+
+    A file is named by a hash of the favicon's URL and holds the icon already
+    scaled to the size it is shown in, so reading it back needs no scaling.
+    The validator (ETag or content hash) and the fetch time of the original
+    image are kept as PNG text chunks. A file's mtime is the time it was last
+    used, and the least recently used files are removed once the cache grows
+    beyond its byte budget. Nothing is read before the first lookup.
+
+    Icons are looked up from the main loop, and written from the threads
+    that decode them.
+    """
+    MAX_NR_BYTES = 4 * 2 ** 20
+    # Eviction goes below the budget, so that it does not run on every write
+    NR_BYTES_AFTER_EVICTION = 3 * 2 ** 20
+    REVALIDATE_AFTER_SECONDS = 60 * 60 * 24 * 7
+
+    def __init__(self, size, directory=None):
+        if directory is None:
+            cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            directory = os.path.join(cache_home, 'textual-switcher', 'favicons')
+        self._directory = directory
+        self._size = size
+        # Counted on the first write
+        self._nr_bytes = None
+        # Guards the byte count and the eviction against concurrent writes
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """Return the cached icon of the URL, its validator and whether it should be revalidated.
+
+        Returns (None, None, None) if the URL is not cached.
+        """
+        path = self._get_path(url)
+        try:
+            icon = Pixbuf.new_from_file(path)
+            os.utime(path)
+        except (GLib.Error, OSError):
+            return None, None, None
+        fetch_time = float(icon.get_option('tEXt::fetch-time') or 0)
+        # The image of a data URL is the URL itself, so it never changes
+        is_stale = not url.startswith('data:') and time.time() - fetch_time > self.REVALIDATE_AFTER_SECONDS
+        return icon, icon.get_option('tEXt::validator'), is_stale
+
+    def put(self, url, icon, validator):
+        path = self._get_path(url)
+        # Unique per thread, in case two threads write the same URL
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            icon.savev(temp_path, 'png', ['tEXt::validator', 'tEXt::fetch-time'],
+                       [validator or '', str(time.time())])
+        except (GLib.Error, OSError) as ex:
+            print("Cannot cache favicon of {}: {}".format(url[:100], ex))
+            return
+        with self._lock:
+            self._store(url, path, temp_path)
+
+    def _store(self, url, path, temp_path):
+        try:
+            self._count_bytes()
+            self._nr_bytes -= self._get_file_size(path)
+            os.replace(temp_path, path)
+            self._nr_bytes += self._get_file_size(path)
+        except OSError as ex:
+            print("Cannot cache favicon of {}: {}".format(url[:100], ex))
+            return
+        if self._nr_bytes > self.MAX_NR_BYTES:
+            self._evict()
+
+    def _get_path(self, url):
+        key = hashlib.blake2b(url.encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self._directory, '{}-{}.png'.format(key, self._size))
+
+    @staticmethod
+    def _get_file_size(path):
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return 0
+
+    def _list_files(self):
+        files = list()
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.png'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _count_bytes(self):
+        if self._nr_bytes is None:
+            self._nr_bytes = sum(size for _, size, _ in self._list_files())
+
+    def _evict(self):
+        files = sorted(self._list_files())
+        self._nr_bytes = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self._nr_bytes <= self.NR_BYTES_AFTER_EVICTION:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            self._nr_bytes -= size
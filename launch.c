@@ -1,9 +1,10 @@
-#define _POSIX_SOURCE
+#define _POSIX_C_SOURCE 200112L
 #include <stdio.h>
 #include <errno.h>
 #include <signal.h>
 #include <unistd.h>
 #include <string.h>
+#include <time.h>
 #include <stdlib.h>
 #include <assert.h>
 #include <signal.h>
@@ -13,6 +14,7 @@
 static const char *PID_FILE_PATH_TEMPLATE = "/run/user/%d/textual-switcher.pid";
 static const char *PYTHON_EXE_PATH = "/usr/bin/python3";
 static const char *SCRIPT_PATH = "/usr/share/textual-switcher/switcher.py";
+static const char *EXEC_TIME_ENV_VAR = "TEXTUAL_SWITCHER_EXEC_TIME";
 
 
 void exec_switcher(char *pid_file_path)
@@ -21,6 +23,13 @@ void exec_switcher(char *pid_file_path)
                              (char*)SCRIPT_PATH,
                              (char*)pid_file_path,
                              NULL};
+    /* Lets the switcher measure its startup from here */
+    struct timespec now;
+    char exec_time[32];
+    if (0 == clock_gettime(CLOCK_MONOTONIC, &now)) {
+        snprintf(exec_time, sizeof(exec_time), "%ld.%09ld", (long)now.tv_sec, now.tv_nsec);
+        setenv(EXEC_TIME_ENV_VAR, exec_time, 1);
+    }
     execvp(PYTHON_EXE_PATH, switcher_argv);
     exit(1);
 }
@@ -1,31 +1,271 @@
+import math
 import unicodedata
-from curses.ascii import isprint
-from fuzzywuzzy import fuzz
 
 
-def filter_printable(s):
-    return ''.join(c for c in s if c in string.printable)
+def normalize(text):
+    """Return the form of a title that is matched against the search key.
+
+    Case is folded, accents and other combining marks are stripped (after an
+    NFKD decomposition) and whitespace and control characters are removed.
+    Non-ASCII letters are kept, so Cyrillic, Hebrew and CJK titles can be
+    searched as well.
+    """
+    if not text:
+        return ""
+    text = text.casefold()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = ''.join(text.split())
+    if not text.isprintable():
+        text = ''.join(c for c in text if c.isprintable())
+    return text
+
+
+def get_length_bound(key_length, candidate_length):
+    """Upper bound of the score of a candidate that is not a substring of the key."""
+    return 200.0 * min(key_length, candidate_length) / (key_length + candidate_length)
+
+
+def _get_lcs_length(key_masks, key_bits, candidate):
+    # Bit-parallel LCS (Hyyro), one bit per search key character
+    v = key_bits
+    for c in candidate:
+        u = v & key_masks.get(c, 0)
+        v = ((v + u) | (v - u)) & key_bits
+    return bin(key_bits & ~v).count('1')
+
+
+def _python_ratios(search_key, candidates):
+    key_masks = dict()
+    for i, c in enumerate(search_key):
+        key_masks[c] = key_masks.get(c, 0) | (1 << i)
+    key_bits = (1 << len(search_key)) - 1
+    key_length = len(search_key)
+    return [200.0 * _get_lcs_length(key_masks, key_bits, candidate) / (key_length + len(candidate))
+            for candidate in candidates]
+
+
+def _get_substring_indices(search_key, candidates):
+    # The substring test of str is faster than rapidfuzz's batched partial_ratio
+    return [index for index, candidate in enumerate(candidates)
+            if search_key in candidate or candidate in search_key]
+
+
+def _python_score_many(search_key, candidates, score_cutoff):
+    # Candidates that cannot reach the cutoff by their length alone are not scored
+    key_length = len(search_key)
+    scores = [None] * len(candidates)
+    indices_to_score = list()
+    for index, candidate in enumerate(candidates):
+        if search_key in candidate or candidate in search_key:
+            scores[index] = 100
+        elif get_length_bound(key_length, len(candidate)) >= score_cutoff:
+            indices_to_score.append(index)
+    ratios = _python_ratios(search_key, [candidates[index] for index in indices_to_score])
+    for index, ratio in zip(indices_to_score, ratios):
+        scores[index] = ratio
+    return scores
+
+
+def _rapidfuzz_score_many(search_key, candidates, score_cutoff):
+    # Candidates that do not reach the cutoff are rejected by rapidfuzz, and are left out of its results
+    scores = [None] * len(candidates)
+    matches = rapidfuzz_process.extract(search_key, candidates, scorer=rapidfuzz_fuzz.ratio,
+                                        processor=None, limit=None, score_cutoff=score_cutoff)
+    for _, score, index in matches:
+        scores[index] = score
+    for index in _get_substring_indices(search_key, candidates):
+        scores[index] = 100
+    return scores
+
+
+# Set by load_scoring_engine
+_score_many = None
+
+
+def load_scoring_engine():
+    """Import rapidfuzz if it is installed, or fall back to scoring in python.
+
+    rapidfuzz takes tens of milliseconds to import, so it is imported once
+    scoring is needed rather than on startup.
+    """
+    global _score_many, rapidfuzz_fuzz, rapidfuzz_process
+    if _score_many is not None:
+        return
+    try:
+        from rapidfuzz import fuzz as rapidfuzz_fuzz, process as rapidfuzz_process
+    except ImportError:
+        _score_many = _python_score_many
+    else:
+        _score_many = _rapidfuzz_score_many
+
+
+def get_scoring_engine_name():
+    """"rapidfuzz" or "python", loading the scoring engine if it was not loaded yet."""
+    load_scoring_engine()
+    return "rapidfuzz" if _score_many is _rapidfuzz_score_many else "python"
+
+
+def score_many(search_key, candidates, score_cutoff=0):
+    """Score normalized candidates against a normalized search key in one batch.
+
+    The score is 100 if either of them is a substring of the other, otherwise
+    it is 200 * LCS / (key length + candidate length). Candidates that are
+    rejected as not reaching score_cutoff get None. The length bound is an
+    upper bound of their score.
+    """
+    if not search_key:
+        return [100] * len(candidates)
+    load_scoring_engine()
+    return _score_many(search_key, candidates, score_cutoff)
+
+
+class _NarrowingLevel(object):
+    """The state of the filter for one search key.
+
+    Levels are stacked while the key is extended, so that a backspace pops
+    back to the parent level (and its results) without rescoring anything.
+    A level only changes when candidates are added or removed, and then only
+    for those candidates.
+    """
+    def __init__(self, search_key, parent):
+        self.search_key = search_key
+        self.parent = parent
+        # Scores of candidates against this level's search key
+        self.scores = dict()
+        self.matches = set()
+        # Candidates that did not match, by the key length at which they might
+        # match again (see ListFilter._get_wake_length)
+        self.dormant = dict()
 
 
 class ListFilter(object):
+    # Candidates scoring above this are considered as matching the search key
+    MIN_MATCH_SCORE = 30
+
     def __init__(self):
-        self._search_key = ""
+        self._candidates = frozenset()
+        self._levels = [self._create_root_level()]
+        # Scores of candidates against the current search key. Since every
+        # level has its own, it is effectively keyed by (search key, candidate).
+        self._score_cache = self._levels[-1].scores
+
+    @property
+    def _search_key(self):
+        return self._levels[-1].search_key
+
+    def set_candidates(self, candidates):
+        """Replace the candidates. Only the ones that were added are scored,
+        and the levels keep their results for the others."""
+        candidates = frozenset(candidates)
+        if candidates == self._candidates:
+            return
+        added = candidates - self._candidates
+        removed = self._candidates - candidates
+        self._candidates = candidates
+        # Matches are replaced rather than updated, since callers may hold the previous ones.
+        # Removed candidates are left in the dormant lists, and are skipped once woken.
+        for level in self._levels:
+            level.matches = level.matches - removed
+            for candidate in removed:
+                level.scores.pop(candidate, None)
+        root = self._levels[0]
+        root.matches = root.matches | added
+        for parent, level in zip(self._levels, self._levels[1:]):
+            self._score_level(level, self._get_narrowing_candidates(parent, level.search_key, added))
 
     def update_search_key(self, search_key):
-        self._search_key = self._normalize(search_key).decode('utf-8','ignore')
+        search_key = normalize(search_key)
+        if search_key == self._search_key:
+            return
+        # Pop back to the longest cached key that the new key extends. Only
+        # the candidates that survived it can match the new key.
+        while not search_key.startswith(self._search_key):
+            self._levels.pop()
+        self._score_cache = self._levels[-1].scores
+        self._narrow(search_key)
+
+    def get_matches(self):
+        return self._levels[-1].matches
+
+    def _create_root_level(self):
+        level = _NarrowingLevel("", None)
+        level.matches = set(self._candidates)
+        return level
+
+    def _narrow(self, search_key):
+        parent = self._levels[-1]
+        if search_key == parent.search_key:
+            return
+        level = _NarrowingLevel(search_key, parent)
+        self._score_level(level, self._get_narrowing_candidates(parent, search_key, self._candidates))
+        self._levels.append(level)
+        self._score_cache = level.scores
+
+    @staticmethod
+    def _get_narrowing_candidates(parent, search_key, among):
+        """The candidates out of `among` that may match `search_key`: the ones that matched
+        the parent level, and the dormant ones of its ancestors that a key this long wakes."""
+        candidates = parent.matches & among
+        woken_key_lengths = range(len(parent.search_key) + 1, len(search_key) + 1)
+        ancestor = parent
+        while ancestor is not None:
+            for key_length in woken_key_lengths:
+                candidates.update(candidate for candidate in ancestor.dormant.get(key_length, ())
+                                  if candidate in among)
+            ancestor = ancestor.parent
+        return candidates
 
-    def _normalize(self, title):
-        title = filter_printable(title)
-        for c in [" ", "\n", "\t"]:
-            title = title.replace(c, "")
-        title = title.lower()
-        return title
+    def _score_level(self, level, candidates):
+        search_key = level.search_key
+        candidates = list(candidates)
+        scores = score_many(search_key, candidates, score_cutoff=self.MIN_MATCH_SCORE)
+        for candidate, score in zip(candidates, scores):
+            if score is None:
+                # Rejected by the cutoff, so only an upper bound of the score is known
+                score = min(get_length_bound(len(search_key), len(candidate)), self.MIN_MATCH_SCORE)
+            else:
+                level.scores[candidate] = score
+                if score > self.MIN_MATCH_SCORE:
+                    level.matches.add(candidate)
+                    continue
+            wake_length = self._get_wake_length(len(search_key), len(candidate), score)
+            level.dormant.setdefault(wake_length, []).append(candidate)
+
+    def _get_wake_length(self, key_length, candidate_length, score):
+        """Minimal search key length at which a non matching candidate might match.
+
+        The score is 200 * LCS / (key length + candidate length), and appending
+        d characters to the key can grow the LCS by at most d. The candidate
+        can also get a perfect score once it becomes a substring of the key.
+        `score` may be an upper bound of the actual score.
+        """
+        total_length = key_length + candidate_length
+        # Leave a margin for scores that were rounded or carry floating point errors
+        max_lcs = (score + 0.5) * total_length / 200.0
+        min_ratio = self.MIN_MATCH_SCORE - 0.5
+        nr_chars_to_match_ratio = math.ceil((min_ratio * total_length - 200 * max_lcs) / (200 - min_ratio))
+        nr_chars_to_be_contained = max(candidate_length - key_length, math.ceil(candidate_length - max_lcs))
+        nr_chars = max(1, min(nr_chars_to_match_ratio, nr_chars_to_be_contained))
+        return key_length + nr_chars
 
     def get_candidate_score(self, candidate):
-        if not self._search_key:
-            return 100
-        candidate = self._normalize(candidate)
-        if candidate in self._search_key or self._search_key in candidate:
-            return 100
-        score = fuzz.ratio(self._search_key, candidate)
+        """Score a candidate that was already normalized with `normalize`."""
+        score = self._score_cache.get(candidate)
+        if score is None:
+            score = score_many(self._search_key, [candidate])[0]
+            self._score_cache[candidate] = score
         return score
+
+    def score_many(self, candidates):
+        """Score normalized candidates against the current search key.
+
+        Returns the scores in the order of the candidates. Scores are cached,
+        so only the candidates that were not scored yet for this key are
+        passed to the scoring engine, all in a single batch.
+        """
+        unscored = [candidate for candidate in set(candidates) if candidate not in self._score_cache]
+        if unscored:
+            self._score_cache.update(zip(unscored, score_many(self._search_key, unscored)))
+        return [self._score_cache[candidate] for candidate in candidates]
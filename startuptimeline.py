@@ -0,0 +1,59 @@
+"""The timeline of the switcher's startup, from the exec of python to the first frame.
+
+Imported first, so it imports nothing heavy.
+"""
+import os
+import time
+
+
+# Set by the launcher to the CLOCK_MONOTONIC time at which it executed the switcher
+EXEC_TIME_ENV_VAR = "TEXTUAL_SWITCHER_EXEC_TIME"
+# Print the timeline once the startup is done. It is also printed on SIGUSR1.
+PRINT_ENV_VAR = "TEXTUAL_SWITCHER_PRINT_STARTUP_TIMELINE"
+
+
+def _get_exec_time():
+    exec_time = os.environ.pop(EXEC_TIME_ENV_VAR, None)
+    if exec_time is not None:
+        try:
+            return float(exec_time)
+        except ValueError:
+            pass
+    # Not run by the launcher, so fall back to the start time of the process,
+    # which is only known in clock ticks since boot
+    try:
+        with open("/proc/self/stat") as stat_file:
+            stat = stat_file.read()
+        start_time_in_ticks = int(stat[stat.rindex(')') + 2:].split()[19])
+    except (OSError, ValueError):
+        return time.monotonic()
+    time_since_start = time.clock_gettime(time.CLOCK_BOOTTIME) - start_time_in_ticks / os.sysconf('SC_CLK_TCK')
+    return time.monotonic() - time_since_start
+
+
+_exec_time = _get_exec_time()
+_marks = list()
+
+
+def mark(name):
+    """Record that the startup reached a point. Returns False if it was already recorded."""
+    if any(mark_name == name for mark_name, _ in _marks):
+        return False
+    _marks.append((name, time.monotonic()))
+    return True
+
+
+def finish(name):
+    """Record the end of the startup, and print the timeline if the environment asks for it."""
+    if mark(name) and os.environ.get(PRINT_ENV_VAR):
+        print(format_timeline())
+
+
+def format_timeline():
+    lines = ["Startup timeline (ms since exec, ms since previous step):"]
+    previous_time = _exec_time
+    for name, mark_time in _marks:
+        lines.append("{:>8.1f} {:>+8.1f}  {}".format(1000 * (mark_time - _exec_time),
+                                                     1000 * (mark_time - previous_time), name))
+        previous_time = mark_time
+    return "\n".join(lines)
@@ -1,24 +1,33 @@
+import startuptimeline
+startuptimeline.mark("python started")
 import gi
 import os
 import sys
 import signal
-import subprocess
 gi.require_version('Gtk', '3.0')
 gi.require_version('GdkPixbuf', '2.0')
-from gi.repository.GdkPixbuf import Pixbuf, InterpType
-from gi.repository import Gtk, GdkX11
+from gi.repository.GdkPixbuf import Pixbuf
+from gi.repository import Gtk, GdkX11, GLib
 import pidfile
+import iconcache
 import listfilter
-import tabcontrol
 import glib_wrappers
-import windowcontrol
+import windowsnapshot
 import keycodes
+# windowcontrol and tabcontrol are imported once the window was painted
+startuptimeline.mark("GTK imported")
 
 
 class EntryWindow(Gtk.Window):
     WINDOW_TITLE = "Textual Switcher"
-    _COL_NR_ICON, _COL_NR_TITLE, _COL_NR_WINDOW_ID, _COL_NR_TAB_ID = range(4)
+    _COL_NR_ICON, _COL_NR_TITLE, _COL_NR_WINDOW_ID, _COL_NR_TAB_ID, _COL_NR_VISIBLE = range(5)
+    NON_TAB_FLAG = -1
     ICON_SIZE = 25
+    MAX_REFRESH_LATENCY_MS = 30
+    # Tabs from the snapshot are dropped if their browser did not list its tabs by then
+    SNAPSHOT_TABS_TIMEOUT_MS = 5000
+    # Shown until the icon of a window is known
+    PLACEHOLDER_ICON_NAME = "application-x-executable"
     FULL_HELP_TEXT = ("Ctrl+J: Down\n"
                       "Ctrl+K: Up\n"
                       "Ctrl+W/U: Empty search filter\n"
@@ -26,29 +35,113 @@ class EntryWindow(Gtk.Window):
                       "Ctrl+D: Last\n"
                       "Ctrl+Backspace: SIGTERM selected\n"
                       "Ctrl+\\: SIGKILL selected\n"
-                      "Ctrl+C: Hide\n"
+                      "Ctrl+C/Escape: Hide\n"
                       "Ctrl+H: Toggle Help")
     SHORT_HELP_TEXT = "Ctrl+H: Toggle Help"
 
     def __init__(self):
         Gtk.Window.__init__(self, title=self.WINDOW_TITLE)
         self._xid = None
+        self._row_iters = dict()
+        self._row_candidates = dict()
+        self._candidate_rows = dict()
+        self._matching_candidates = set()
+        # Shared by the window and the tab icons
+        self._icon_interner = iconcache.IconInterner()
+        self._icon_cache = iconcache.ScaledIconCache(self._icon_interner)
+        self._placeholder_icon = None
+        self._refresh_scheduler = glib_wrappers.CoalescingScheduler(self._refresh_tree,
+                                                                    self.MAX_REFRESH_LATENCY_MS)
         self._search_textbox = self._create_search_textbox()
         self._tree = self._create_tree()
         self._treefilter = self._create_tree_filter()
         self._treeview = self._create_treeview()
         self._select_first_window()
-        self._windowcontrol = windowcontrol.WindowControl()
+        # Created by _start_controls, after the first frame
+        self._windowcontrol = None
+        self._tabcontrol = None
         self._listfilter = listfilter.ListFilter()
-        self._tabcontrol = tabcontrol.TabControl(self._update_tabs_callback, self._tab_icon_ready)
         glib_wrappers.register_signal(self._focus_on_me, signal.SIGHUP)
+        glib_wrappers.register_signal(self._print_stats, signal.SIGUSR1)
         self._set_window_properties()
         self._help_label = self._create_help_label()
         self._add_gui_components_to_window()
-        self._async_list_windows()
-        self._windows = None
+        self._windows = dict()
         self._tabs = {}
         self._expanded_mode = True
+        # Until then, the windows are the ones of the snapshot
+        self._are_windows_live = False
+        # Browsers whose tabs are the ones of the snapshot, by PID
+        self._snapshot_tab_pids = set()
+        # Selected before the windows were live, and focused once it is known to still exist
+        self._pending_selection = None
+        self._show_snapshot()
+        self._first_draw_handler_id = self.connect_after("draw", self._first_draw_callback)
+        startuptimeline.mark("window created")
+
+    def _first_draw_callback(self, *args):
+        startuptimeline.mark("first frame")
+        self.disconnect(self._first_draw_handler_id)
+        GLib.idle_add(self._start_controls)
+        return False
+
+    def _start_controls(self):
+        # Imported only now, so that Wnck and the tab listing do not delay the first frame
+        import windowcontrol
+        import tabcontrol
+        self._windowcontrol = windowcontrol.WindowControl(icon_interner=self._icon_interner)
+        self._tabcontrol = tabcontrol.TabControl(self._update_tabs_callback, self._tab_icon_ready, self.ICON_SIZE,
+                                                 self._icon_interner)
+        if not self.get_visible():
+            # Hidden before the controls were started
+            self._tabcontrol.pause_icon_fetches()
+        startuptimeline.mark("window and tab controls started")
+        if not self._windowcontrol.watch_windows(self._windows_changed_callback):
+            self._async_list_windows()
+        listfilter.load_scoring_engine()
+        return False
+
+    def _is_started(self):
+        return self._windowcontrol is not None
+
+    def _show_snapshot(self):
+        snapshot = windowsnapshot.load(windowsnapshot.get_snapshot_path())
+        if snapshot is None:
+            return
+        windows, self._tabs = snapshot
+        self._windows = {window.xid: window for window in windows}
+        self._snapshot_tab_pids = set(self._tabs)
+        self._refresh_tree()
+        startuptimeline.mark("snapshot shown")
+
+    def save_snapshot(self):
+        if self._are_windows_live:
+            try:
+                windowsnapshot.save(windowsnapshot.get_snapshot_path(), self._windows.values(), self._tabs)
+            except OSError as ex:
+                print("Failed saving the snapshot of windows: {}".format(ex))
+        return False
+
+    def _set_windows_live(self):
+        self._are_windows_live = True
+        GLib.timeout_add(self.SNAPSHOT_TABS_TIMEOUT_MS, self._drop_snapshot_tabs)
+        if self._pending_selection is not None:
+            # Once all the live windows were received
+            GLib.idle_add(self._activate_pending_selection)
+
+    def _drop_snapshot_tabs(self):
+        for pid in self._snapshot_tab_pids:
+            self._tabs.pop(pid, None)
+        self._snapshot_tab_pids.clear()
+        self._refresh_scheduler.schedule()
+        return False
+
+    def _activate_pending_selection(self):
+        window_id, tab_id = self._pending_selection
+        self._pending_selection = None
+        if window_id in self._windows:
+            self._activate(window_id, tab_id)
+        return False
 
     def _set_window_properties(self):
         self.set_size_request(500, 500)
@@ -63,7 +156,7 @@ class EntryWindow(Gtk.Window):
         vbox.pack_start(self._help_label, False, True, 0)
 
     def _create_tree(self):
-        tree = Gtk.TreeStore(Pixbuf, str, int, int)
+        tree = Gtk.TreeStore(Pixbuf, str, int, int, bool)
         tree.set_sort_func(1, self._compare_windows)
         tree.set_sort_column_id(1, Gtk.SortType.ASCENDING)
         return tree
@@ -78,7 +171,7 @@ class EntryWindow(Gtk.Window):
 
     def _create_tree_filter(self):
         tree_filter = self._tree.filter_new()
-        tree_filter.set_visible_func(self._filter_window_list_by_search_key)
+        tree_filter.set_visible_column(self._COL_NR_VISIBLE)
         return tree_filter
 
     def _create_treeview(self):
@@ -112,10 +205,23 @@ class EntryWindow(Gtk.Window):
 
     def _focus_on_me(self):
         self.set_visible(True)
-        self._windowcontrol.async_focus_on_window(self._get_xid())
-        self._async_list_windows()
+        self.present_with_time(self._get_x_timestamp())
+        if self._is_started():
+            self._tabcontrol.resume_icon_fetches()
+        if self._is_started() and self._windowcontrol.is_watching_windows():
+            # The windows are already up to date, only the tabs are relisted
+            self._async_list_tabs_from_windows_list(self._windows.values())
+        else:
+            self._async_list_windows()
         self._search_textbox.set_text("")
 
+    def _hide(self):
+        self.set_visible(False)
+        GLib.idle_add(self.save_snapshot)
+        if self._is_started():
+            # Icons that are still missing are fetched when the switcher is shown again
+            self._tabcontrol.pause_icon_fetches()
+
     def _get_xid(self):
         if self._xid is None:
             try:
@@ -125,6 +231,13 @@ class EntryWindow(Gtk.Window):
                 raise
         return self._xid
 
+    def _get_x_timestamp(self):
+        # Window managers may ignore activation requests without a proper timestamp
+        timestamp = Gtk.get_current_event_time()
+        if timestamp == 0:
+            timestamp = GdkX11.x11_get_server_time(self.get_window())
+        return timestamp
+
     def _combine_title_and_wm_class(self, window_title, wm_class):
         if wm_class is not None and wm_class:
             wm_class = wm_class.split(".")[-1]
@@ -135,9 +248,9 @@ class EntryWindow(Gtk.Window):
 
     def _compare_windows(self, model, iter_a, iter_b, user_data):
         window_a = self._windows[model[iter_a][self._COL_NR_WINDOW_ID]]
-        window_a_score = self._get_score(window_a.title, window_a.wm_class)
+        window_a_score = self._get_score(window_a.normalized_title, window_a.normalized_wm_class)
         window_b = self._windows[model[iter_b][self._COL_NR_WINDOW_ID]]
-        window_b_score = self._get_score(window_b.title, window_b.wm_class)
+        window_b_score = self._get_score(window_b.normalized_title, window_b.normalized_wm_class)
 
         if window_a_score > window_b_score:
             return -1
@@ -148,35 +261,168 @@ class EntryWindow(Gtk.Window):
     def _update_windows_listbox_callback(self, windows):
         windows = [window for window in windows if window.xid != self._get_xid()]
         self._windows = {window.xid: window for window in windows}
-        self._refresh_tree()
+        if not self._are_windows_live:
+            self._set_windows_live()
+        self._refresh_scheduler.schedule()
         self._async_list_tabs_from_windows_list(windows)
 
+    def _windows_changed_callback(self, updated_windows, removed_xids):
+        browser_pids = self._get_browser_pids()
+        if not self._are_windows_live:
+            # The live windows replace the snapshot. They are all received in
+            # one iteration of the main loop, before the tree is refreshed, but
+            # possibly one at a time.
+            self._windows.clear()
+            browser_pids = None
+            self._set_windows_live()
+        for xid in removed_xids:
+            self._windows.pop(xid, None)
+        for window in updated_windows:
+            if window.xid != self._get_xid():
+                self._windows[window.xid] = window
+        self._refresh_scheduler.schedule()
+        if self._get_browser_pids() != browser_pids:
+            self._async_list_tabs_from_windows_list(self._windows.values())
+
+    def _window_icons_ready_callback(self, windows):
+        self._refresh_scheduler.schedule()
+
+    def _get_browser_pids(self):
+        return set(window.pid for window in self._windows.values() if window.is_browser())
+
     def _refresh_tree(self):
-        self._tree.clear()
+        """Reconcile the tree with the current windows and tabs.
+
+        Rows are keyed by (window ID, tab ID). Only rows that were added,
+        removed or changed are touched, so the iters of the other rows and the
+        cursor are kept.
+        """
+        rows = self._get_tree_rows()
+        if self._are_windows_live and self._windows:
+            startuptimeline.finish("live windows shown")
+        self._evict_stale_icons()
+        self._remove_stale_rows(set(row_key for _, row_key, _, _ in rows))
+        self._index_row_candidates(rows)
+        self._listfilter.set_candidates(self._candidate_rows.keys())
+        self._matching_candidates = self._listfilter.get_matches()
+        were_rows_inserted = False
+        for parent_row_key, row_key, row, _ in rows:
+            row.append(self._is_row_matching(row_key))
+            row_iter = self._row_iters.get(row_key)
+            if row_iter is None:
+                parent_iter = None if parent_row_key is None else self._row_iters[parent_row_key]
+                self._row_iters[row_key] = self._tree.append(parent_iter, row)
+                were_rows_inserted = True
+            else:
+                self._update_row(row_iter, row)
+        if were_rows_inserted:
+            self._enforce_expanded_mode()
+        if not self._is_some_window_selected():
+            self._select_first_window()
+
+    def _get_tree_rows(self):
+        rows = list()
         for window in self._windows.values():
             window_row_label = self._combine_title_and_wm_class(window.title, window.wm_class)
-            NON_TAB_FLAG = -1
-            if window.icon is not None:
-                window.icon = window.icon.scale_simple(self.ICON_SIZE, self.ICON_SIZE, InterpType.BILINEAR)
-            row = [window.icon, window_row_label, window.xid, NON_TAB_FLAG]
-            row_iter = self._tree.append(None, row)
+            icon = self._get_window_icon(window)
+            row = [icon, window_row_label, window.xid, self.NON_TAB_FLAG]
+            row_key = (window.xid, self.NON_TAB_FLAG)
+            rows.append((None, row_key, row, self._get_window_candidates(window)))
             if window.is_browser():
-                self._add_tabs_of_window_to_tree(window, row_iter)
-        self._enforce_expanded_mode()
-        self._select_first_window()
+                rows.extend(self._get_tab_rows_of_window(window, row_key))
+        return rows
 
-    def _add_tabs_of_window_to_tree(self, window, row_iter):
+    def _get_window_icon(self, window):
+        icon = window.icon
+        if icon is None:
+            icon = self._get_placeholder_icon()
+        return self._icon_cache.get(window.xid, icon, self.ICON_SIZE)
+
+    def _get_placeholder_icon(self):
+        if self._placeholder_icon is None:
+            try:
+                self._placeholder_icon = Gtk.IconTheme.get_default().load_icon(
+                    self.PLACEHOLDER_ICON_NAME, self.ICON_SIZE, 0)
+            except GLib.Error:
+                pass
+        return self._placeholder_icon
+
+    def _evict_stale_icons(self):
+        icon_source_keys = set(self._windows)
+        for tabs in self._tabs.values():
+            icon_source_keys.update(tab.get('favIconUrl') for tab in tabs)
+        self._icon_cache.retain(icon_source_keys)
+        icons_in_use = [window.icon for window in self._windows.values()]
+        icons_in_use.extend(self._icon_cache.get_icons())
+        if self._is_started():
+            self._tabcontrol.retain_tab_icons(icon_source_keys)
+            icons_in_use.extend(self._tabcontrol.get_cached_tab_icons())
+        self._icon_interner.retain(icons_in_use)
+
+    def _remove_stale_rows(self, row_keys):
+        stale_row_keys = [row_key for row_key in self._row_iters if row_key not in row_keys]
+        # Remove tabs before their windows, as removing a window removes its tabs as well
+        stale_row_keys.sort(key=lambda row_key: row_key[1] == self.NON_TAB_FLAG)
+        for row_key in stale_row_keys:
+            self._tree.remove(self._row_iters.pop(row_key))
+
+    def _index_row_candidates(self, rows):
+        self._row_candidates = {row_key: candidates for _, row_key, _, candidates in rows}
+        self._candidate_rows.clear()
+        for row_key, candidates in self._row_candidates.items():
+            for candidate in candidates:
+                self._candidate_rows.setdefault(candidate, list()).append(row_key)
+
+    def _update_row(self, row_iter, row):
+        for col_nr in (self._COL_NR_ICON, self._COL_NR_TITLE, self._COL_NR_VISIBLE):
+            if self._tree.get_value(row_iter, col_nr) != row[col_nr]:
+                self._tree.set_value(row_iter, col_nr, row[col_nr])
+
+    def _get_tab_rows_of_window(self, window, window_row_key):
+        rows = list()
         if window.pid in self._tabs:
             for tab in self._tabs[window.pid]:
-                icon = self._tabcontrol.get_tab_icon(tab)
+                # Tabs of the snapshot may be shown before the tab control is started
+                icon = self._tabcontrol.get_tab_icon(tab) if self._is_started() else None
                 if icon is None:
-                    icon = window.icon
+                    icon = self._get_window_icon(window)
                 else:
-                    icon = icon.scale_simple(self.ICON_SIZE, self.ICON_SIZE, InterpType.BILINEAR)
-                self._tree.append(row_iter, [icon, tab['title'], window.xid, tab['id']])
+                    icon = self._icon_cache.get(tab['favIconUrl'], icon, self.ICON_SIZE)
+                row = [icon, tab['title'], window.xid, tab['id']]
+                candidates = self._with_wm_class(tab['normalized_title'], window.normalized_wm_class)
+                rows.append((window_row_key, (window.xid, tab['id']), row, candidates))
+        return rows
+
+    def _get_window_candidates(self, window):
+        token = window.normalized_title
+        if window.is_browser() and window.pid in self._tabs:
+            token += ''.join(tab['normalized_title'] for tab in self._tabs[window.pid])
+        return self._with_wm_class(token, window.normalized_wm_class)
+
+    @staticmethod
+    def _with_wm_class(token, wm_class):
+        if wm_class is not None and wm_class:
+            return (token, wm_class)
+        return (token,)
+
+    def _is_row_matching(self, row_key):
+        return any(candidate in self._matching_candidates for candidate in self._row_candidates[row_key])
+
+    def _update_rows_visibility(self):
+        matching_candidates = self._listfilter.get_matches()
+        changed_candidates = matching_candidates ^ self._matching_candidates
+        self._matching_candidates = matching_candidates
+        changed_rows = set()
+        for candidate in changed_candidates:
+            changed_rows.update(self._candidate_rows.get(candidate, ()))
+        for row_key in changed_rows:
+            row_iter = self._row_iters[row_key]
+            is_visible = self._is_row_matching(row_key)
+            if self._tree.get_value(row_iter, self._COL_NR_VISIBLE) != is_visible:
+                self._tree.set_value(row_iter, self._COL_NR_VISIBLE, is_visible)
 
     def _tab_icon_ready(self, url, icon):
-        self._refresh_tree()
+        self._refresh_scheduler.schedule()
 
     def _enforce_expanded_mode(self):
         if self._expanded_mode:
@@ -187,17 +433,24 @@ class EntryWindow(Gtk.Window):
     def _async_list_tabs_from_windows_list(self, windows):
         active_browsers = [window for window in windows if window.is_browser()]
         active_browsers_pids = [browser.pid for browser in active_browsers]
-        stale_browser_pids = [pid for pid in self._tabs if pid not in active_browsers_pids]
+        # Tabs of the snapshot are kept until their browser lists its tabs or they time out,
+        # since live windows may arrive one at a time
+        stale_browser_pids = [pid for pid in self._tabs
+                              if pid not in active_browsers_pids and pid not in self._snapshot_tab_pids]
         for pid in stale_browser_pids:
             del self._tabs[pid]
         self._tabcontrol.async_list_browsers_tabs(active_browsers)
 
     def _update_tabs_callback(self, pid, tabs):
+        self._snapshot_tab_pids.discard(pid)
         self._tabs[pid] = tabs
-        self._refresh_tree()
+        self._refresh_scheduler.schedule()
 
     def _async_list_windows(self):
-        self._windowcontrol.async_list_windows(callback=self._update_windows_listbox_callback)
+        if not self._is_started():
+            return
+        self._windowcontrol.async_list_windows(callback=self._update_windows_listbox_callback,
+                                               icons_callback=self._window_icons_ready_callback)
 
     def _select_last_item(self):
         cursor = self._treeview.get_cursor()[0]
@@ -262,7 +515,8 @@ class EntryWindow(Gtk.Window):
         elif keycode == keycodes.KEYCODE_ARROW_UP:
             self._select_previous_item()
         elif keycode == keycodes.KEYCODE_ESCAPE:
-            sys.exit(0)
+            # Stays resident, so showing it again does not pay for a cold start
+            self._hide()
         elif is_ctrl_pressed:
             if keycode == keycodes.KEYCODE_D:
                 self._select_last_item()
@@ -271,7 +525,7 @@ class EntryWindow(Gtk.Window):
             elif keycode == keycodes.KEYCODE_K:
                 self._select_previous_item()
             elif keycode == keycodes.KEYCODE_C:
-                self.set_visible(False)
+                self._hide()
             elif keycode == keycodes.KEYCODE_L:
                 self._async_list_windows()
                 self._select_first_window()
@@ -311,26 +565,36 @@ class EntryWindow(Gtk.Window):
         return _iter is not None
 
     def _window_selected_callback(self, *_):
+        self._refresh_scheduler.flush()
         window_id = self._get_value_of_selected_row(self._COL_NR_WINDOW_ID)
         if window_id is None:
             return
-        try:
-            self._windowcontrol.focus_on_window(window_id)
+        tab_id = self._get_value_of_selected_row(self._COL_NR_TAB_ID)
+        if not self._are_windows_live:
+            # The window is from the snapshot, and may no longer exist
+            self._pending_selection = (window_id, tab_id)
+            return
+        self._activate(window_id, tab_id)
+
+    def _activate(self, window_id, tab_id):
+        if self._windowcontrol.focus_on_window(window_id, self._get_x_timestamp()):
             # Setting the window to not visible causes Alt+Tab to avoid switcher (which is good)
-            self.set_visible(False)
-        except subprocess.CalledProcessError:
+            self._hide()
+        else:
             # Actual window list has changed since last reload
             self._async_list_windows()
-        tab_id = self._get_value_of_selected_row(self._COL_NR_TAB_ID)
         is_tab = tab_id >= 0
         if is_tab:
             window = self._windows[window_id]
             self._tabcontrol.async_move_to_tab(tab_id, window.pid)
 
     def _text_changed_callback(self, search_textbox):
+        # Rows must match the current windows and tabs before they are filtered
+        self._refresh_scheduler.flush()
         search_key = search_textbox.get_text()
         self._listfilter.update_search_key(search_key)
-        self._treefilter.refilter()
+        self._score_window_titles()
+        self._update_rows_visibility()
         if not self._is_some_window_selected():
             self._select_first_window()
         self._enforce_expanded_mode()
@@ -357,9 +621,9 @@ class EntryWindow(Gtk.Window):
             best_score_so_far = None
             while child_iter is not None:
                 child_row = model[child_iter]
-                child_title = child_row[self._COL_NR_TITLE]
+                child_row_key = (selected_window_id, child_row[self._COL_NR_TAB_ID])
+                child_title = self._row_candidates[child_row_key][0]
                 child_score = self._listfilter.get_candidate_score(child_title)
-                #print((child_title, child_score))
                 if best_row_so_far is None or child_score > best_score_so_far:
                     best_row_so_far = child_row
                     best_score_so_far = child_score
@@ -368,7 +632,7 @@ class EntryWindow(Gtk.Window):
             # Select the child row if better score than window
             if best_row_so_far is not None:
                 window = self._windows[selected_window_id]
-                window_score = self._get_score(window.title, window.wm_class)
+                window_score = self._get_score(window.normalized_title, window.normalized_wm_class)
                 if best_score_so_far >= window_score:
                     # Selct tab
                     self._treeview.set_cursor(best_row_so_far.path)
@@ -378,6 +642,12 @@ class EntryWindow(Gtk.Window):
             else:
                 self._select_first_window()
 
+    def _score_window_titles(self):
+        # Sorting and tab selection also score the bare titles of browser
+        # windows, which are not filter candidates. Score them in one batch.
+        titles = [window.normalized_title for window in self._windows.values() if window.is_browser()]
+        self._listfilter.score_many(titles)
+
     def _select_first_window(self):
         if len(self._tree):
             self._treeview.set_cursor(0)
@@ -389,37 +659,23 @@ class EntryWindow(Gtk.Window):
             score = max(score, wm_class_score)
         return score
 
-    def _filter_window_list_by_search_key(self, model, _iter, data):
-        row = model[_iter]
-        window_id = row[self._COL_NR_WINDOW_ID]
-        if window_id not in self._windows:
-            return False
-        title = row[self._COL_NR_TITLE]
-        window = self._windows[window_id]
-        token = title
-        #if isinstance(token, str):
-        #    token = unicode(token, 'utf-8')
-        tab_id = row[self._COL_NR_TAB_ID]
-        is_tab = tab_id >= 0
-        if window.pid in self._tabs:
-            if window.is_browser() and not is_tab:
-                tabs = self._tabs[window.pid]
-                sep = ' '
-                token += sep.join(tab['title'] for tab in tabs)
-            elif is_tab:
-                matching = [tab for tab in self._tabs[window.pid] if tab['id'] == tab_id]
-                if matching:
-                    tab = matching[0]
-                    token = tab['title']
-        score = self._get_score(token, window.wm_class)
-        return score > 30
-
     def _send_signal_to_selected_process(self, signal_type):
+        if not self._are_windows_live:
+            # The PID of a window from the snapshot may have been reused by now
+            return
         window_id = self._get_value_of_selected_row(self._COL_NR_WINDOW_ID)
         window = self._windows[window_id]
         os.kill(window.pid, signal_type)
         self._async_list_windows()
 
+    def _print_stats(self):
+        nr_requested = self._refresh_scheduler.nr_requested
+        nr_executed = self._refresh_scheduler.nr_executed
+        print("Tree refreshes: {} requested, {} executed ({:.1f} requests per refresh)".format(
+            nr_requested, nr_executed, nr_requested / max(nr_executed, 1)))
+        print(self._icon_interner.get_stats())
+        print(startuptimeline.format_timeline())
+
     def _toggle_help_text(self):
         if self._help_label.get_text() == self.SHORT_HELP_TEXT:
             self._help_label.set_text(self.FULL_HELP_TEXT)
@@ -446,3 +702,4 @@ if __name__ == "__main__":
     show_window(window)
 
     Gtk.main()
+    window.save_snapshot()
@@ -1,15 +1,17 @@
 import os
-import json
 import base64
-import struct
+import socket
+import hashlib
 import logging
 import os.path
 import traceback
+import concurrent.futures
 import unicodedata
-import expiringdict
+import iconcache
+import listfilter
+import tabprotocol
 import glib_wrappers
-from gi.repository import GLib, Gio
-from gi.repository.GdkPixbuf import Pixbuf
+from gi.repository import GLib
 
 
 KNOWN_ICON_TYPES = (
@@ -28,277 +30,400 @@ KNOWN_BASE64_ICON_TYPES = (
 logger = logging.getLogger(__file__)
 
 
-class ApiProxyNotReady(Exception): pass
-
-
-class ApiProxyFdContentionTryAgainLater(Exception): pass
-
-
 class BrowserTabLister(object):
-    API_PROXY_NAMED_PIPES_DIR = os.path.join('/run', 'user', str(os.getuid()), "textual-switcher-proxy")
-    OUT_PIPE_FILENAME = os.path.join(API_PROXY_NAMED_PIPES_DIR, "textual_switcher_to_api_proxy_for_firefox_pid_%d")
-    IN_PIPE_FILENAME = os.path.join(API_PROXY_NAMED_PIPES_DIR, "api_proxy_to_textual_switcher_for_firefox_pid_%d")
-
-    def __init__(self, pid, update_tabs_callback):
-        self.pid = pid
-        self._is_updated = True
+    """Keeps a live copy of the tabs of the browser of one API proxy.
+
+    Every proxy connects to the switcher's broker socket. It registers with
+    the PIDs of its ancestors, one of which is the browser that owns the
+    windows of its tabs. The proxy keeps a versioned table of the browser's
+    tabs, and this mirrors it. On connection and on every listing, the proxy
+    is asked for the changes since the mirror's version, and tab changes are
+    pushed by the proxy as they happen. Messages are read as soon as the
+    connection is readable.
+
+    At most one sync request is outstanding. Its reply is recognized by the
+    request's id, and if it does not arrive in time, the request is given
+    up and the reply is discarded whenever it arrives.
+    """
+    SYNC_TIMEOUT_MS = 2000
+    # Sends block, since they are small, but not for long if the proxy is stuck
+    SEND_TIMEOUT_SECONDS = 1
+
+    # Connection states
+    STATE_IDLE, STATE_SYNCING, STATE_DISCONNECTED = range(3)
+
+    def __init__(self, connection, register_callback, update_tabs_callback, disconnection_callback):
+        self._connection = connection
+        self._connection.settimeout(self.SEND_TIMEOUT_SECONDS)
+        self._register_callback = register_callback
         self._update_tabs_callback = update_tabs_callback
-        self._is_new_list_tab_request = True
-        self._nr_retries_left = 1000
-
-        in_pipe_filename = self.IN_PIPE_FILENAME % (pid,)
-        try:
-            self.in_fd = os.open(in_pipe_filename, os.O_RDONLY | os.O_NONBLOCK)
-        except Exception as ex:
-            print('Failed to open in FD for browser PID {}: {}'.format(pid, str(ex)))
-            raise ApiProxyNotReady(pid)
-
-        out_pipe_filename = self.OUT_PIPE_FILENAME % (pid,)
-        try:
-            self._out_fd = os.open(out_pipe_filename, os.O_WRONLY | os.O_NONBLOCK)
-        except Exception as ex:
-            print('Failed to open out FD for browser PID {}: {}'.format(pid, str(ex)))
-            print("Cleaning in fd...")
-            try:
-                os.close(in_fd)
-            except:
-                print("Failed closing the in FD")
-            raise ApiProxyNotReady(pid)
-
-        self.payload = bytes()
-        self.message_length = None
-        self._read_leftovers_from_prev_runs__in_pipe()
-
-    def _read_leftovers_from_prev_runs__in_pipe(self):
-        while True:
-            try:
-                os.read(self.in_fd, 1024)
-            except OSError as ex:
-                if ex.errno == 11:
-                    print("No more data in pipe")
-                    break
-                else:
-                    print("Unexpecter error while draining pipe from previous runs:")
-                    print(traceback.format_exc())
-            except:
-                print("Unexpecter error while draining pipe from previous runs:")
-                print(traceback.format_exc())
-
-    def read(self):
-        # Read length if new payload
-        if self.message_length is None:
-            print("{}: Reading length of 4 bytes".format(self.in_fd))
-            raw_length = os.read(self.in_fd, 4)
-            if not raw_length:
-                print("Invalid raw length")
-                return None
-            self.message_length = struct.unpack('=I', raw_length)[0]
-            print("{}: New length: {} bytes".format(self.in_fd, self.message_length))
-
-        # Read payload
-        read_counter = 0
-        while len(self.payload) < self.message_length:
-            nr_bytes_left_to_read = self.message_length - len(self.payload)
-            try:
-                print('{}: reading 1024 bytes ({} left)'.format(self.in_fd, nr_bytes_left_to_read))
-                chunk = os.read(self.in_fd, min(nr_bytes_left_to_read, 1024))
-            except IOError as ex:
-                if ex.errno == 32:
-                    print("{}: will try again later".format(self.in_fd))
-                    raise ApiProxyFdContentionTryAgainLater
-                else:
-                    raise
-            except OSError as ex:
-                if ex.errno == 11:
-                    print("{}: will try again later (2)".format(self.in_fd))
-                    raise ApiProxyFdContentionTryAgainLater
-                else:
-                    raise
-            self.payload += chunk
-
-            read_counter += 1
-            if read_counter >= 99999:
-                # Just a warning because this happens sometimes, not sure why
-                print("{}: Infinite read from pipe. Dismissing message".format(self.in_fd))
-                return None
-
-        # Decode
+        self._disconnection_callback = disconnection_callback
+        # Known once the proxy registered
+        self.browser_pid = None
+        # The proxy's ancestors, nearest first
+        self.pids = list()
+        self.tab_table = tabprotocol.TabTable()
+        self._state = self.STATE_IDLE
+        self._next_request_id = 0
+        self._pending_request_id = None
+        self._deadline_source_id = None
+
+        # The socket has a timeout, so its fd does not block and is read whole
+        self._reader = tabprotocol.FramedReader(connection.fileno())
+        self._watch_source_id = GLib.io_add_watch(connection.fileno(), GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+                                                  self._receive_messages_from_api_proxy)
+
+    def get_window_pid(self, window_pids):
+        """The PID of the nearest ancestor of the proxy that owns one of the windows."""
+        for pid in self.pids:
+            if pid in window_pids:
+                return pid
+        return None
+
+    def _send(self, message):
+        if self._state == self.STATE_DISCONNECTED:
+            return False
         try:
-            result = self.payload.decode("utf-8")
-        except Exception as ex:
-            print("{}: Could not decode incoming payload: {}".format(self.in_fd, self.payload))
-            result = ''
-        finally:
-            self.payload = bytes()
-            self.message_length = None
-
-        return result
+            self._connection.sendall(tabprotocol.encode_frame(message))
+        except OSError as ex:
+            print("Browser {}: failed sending to API proxy: {}".format(self.browser_pid, ex))
+            self._disconnect()
+            return False
+        return True
 
     def async_move_to_tab(self, tab_id):
-        command = 'move_to_tab:%d;' % (tab_id)
-        command = command.encode('utf-8')
-        os.write(self._out_fd, command)
-
-    def send_list_tabs_command(self, pid):
-        os.write(self._out_fd, b'list_tabs;')
+        self._send(tabprotocol.move_to_tab_op(tab_id))
 
+    def _sync(self):
+        if self._state != self.STATE_IDLE:
+            return
+        self._next_request_id += 1
+        self._pending_request_id = self._next_request_id
+        if not self._send(tabprotocol.sync_op(self.tab_table.epoch, self.tab_table.version,
+                                              self._pending_request_id)):
+            return
+        self._deadline_source_id = GLib.timeout_add(self.SYNC_TIMEOUT_MS, self._sync_timed_out)
+        self._state = self.STATE_SYNCING
+
+    def _sync_timed_out(self):
+        print("Browser {}: no reply to sync request {}".format(self.browser_pid, self._pending_request_id))
+        self._deadline_source_id = None
+        self._end_sync()
+        return False
+
+    def _end_sync(self):
+        if self._deadline_source_id is not None:
+            GLib.source_remove(self._deadline_source_id)
+            self._deadline_source_id = None
+        self._pending_request_id = None
+        if self._state == self.STATE_SYNCING:
+            self._state = self.STATE_IDLE
 
     def async_list_tabs(self):
-        if self._is_updated:
-            self._is_updated = False
-            self._is_new_list_tab_request = True
-
-            print("{}: already updated".format(self.in_fd))
-
-            # Schedule tablist in thread
-            self._activate_callback_for_one_message_from_api_proxy()
-            if self._is_new_list_tab_request:
-                print("{}: SENDING LIST TABS".format(self.in_fd))
-                self._is_new_list_tab_request = False
-                self.send_list_tabs_command(self.pid)
-            else:
-                print("Will read another chunk in a while")
-        else:
-            print("Not updated yet, cannot send another request")
-
-    def clean_fds(self):
-        for fd in [self.in_fd, self.out_fd]:
-            try:
-                os.close(fd)
-            except:
-                pass
-
-    def _activate_callback_for_one_message_from_api_proxy(self):
-        self._nr_retries_left = 1000
-        GLib.io_add_watch(self.in_fd, GLib.IO_IN, self._receive_message_from_api_proxy)
-        GLib.timeout_add(50, self._receive_message_from_api_proxy)
-
-    def _receive_message_from_api_proxy(self, *args, **kwargs):
-        # Check if we got updated by the fd-based callback before the timer-tick-based callback
-        if self._is_updated:
-            return False
-
-        self._nr_retries_left = max(0, self._nr_retries_left - 1)
-        if self._nr_retries_left == 0:
-            self._is_updated = True
-            return False
+        # Costs as much as the changes that were not pushed yet, if any
+        self._sync()
+
+    def close(self):
+        self._end_sync()
+        self._state = self.STATE_DISCONNECTED
+        if self._watch_source_id is not None:
+            GLib.source_remove(self._watch_source_id)
+            self._watch_source_id = None
+        self._connection.close()
+
+    def _disconnect(self):
+        if self._state == self.STATE_DISCONNECTED:
+            return
+        self.close()
+        self._disconnection_callback(self)
 
-        content = None
+    def _receive_messages_from_api_proxy(self, fd, condition):
         try:
-            content = self.read()
-        except ApiProxyFdContentionTryAgainLater:
-            print("scheduling another list tabs (self._is_updated stays False)")
-        except Exception as ex:
+            is_connected = self._reader.read()
+        except Exception:
             print(traceback.format_exc())
+            is_connected = False
 
-        if content is not None:
+        are_tabs_changed = False
+        while True:
             try:
-                tabs = json.loads(content)
-            except:
-                print('cannot load content of size {}:'.format(len(content)))
-                return
-            self._update_tabs_callback(self.pid, tabs)
-            self._is_updated = True
-
-        whether_to_repeat = not self._is_updated
-        return whether_to_repeat
+                message = self._reader.pop_message()
+            except tabprotocol.ProtocolError as ex:
+                print("Browser {}: {}".format(self.browser_pid, ex))
+                continue
+            if message is None:
+                break
+            are_tabs_changed = self._handle_message(message) or are_tabs_changed
+
+        if are_tabs_changed:
+            self._update_tabs_callback(self)
+        if not is_connected:
+            # Removed once this returns False
+            self._watch_source_id = None
+            self._disconnect()
+        return self._state != self.STATE_DISCONNECTED
+
+    def _handle_message(self, message):
+        if message.get('op') == tabprotocol.OP_REGISTER:
+            self.browser_pid = message['browser_pid']
+            self.pids = message['pids']
+            self._register_callback(self)
+            return False
+        request_id = message.get('id')
+        if request_id is not None:
+            if request_id != self._pending_request_id:
+                print("Browser {}: discarding stale reply to request {}".format(self.browser_pid, request_id))
+                return False
+            self._end_sync()
+        version = self.tab_table.version
+        if not self.tab_table.apply(message):
+            # Missed some changes
+            print("Browser {}: out of sync at version {}".format(self.browser_pid, version))
+            self._sync()
+            return False
+        return self.tab_table.version != version or message['op'] == tabprotocol.OP_SNAPSHOT
 
 
 class TabControl(object):
-    ONE_MONTH_IN_SECONDS = 60 * 60 * 24 * 7 * 4
+    NR_ICON_DECODING_THREADS = 2
+    LISTEN_BACKLOG = 16
 
-    def __init__(self, update_tabs_callback, update_tab_icon_callback):
+    def __init__(self, update_tabs_callback, update_tab_icon_callback, icon_size, icon_interner):
         self._update_tab_icon_callback = update_tab_icon_callback
+        self._icon_size = icon_size
+        self._icon_interner = icon_interner
+        # Window PID -> the listers of the API proxies of that browser. A
+        # browser runs a proxy per profile that has the extension.
         self.browsers = dict()
-        self._icon_cache = expiringdict.ExpiringDict(max_len=100, max_age_seconds=self.ONE_MONTH_IN_SECONDS)
+        self._listers = list()
+        self._active_browser_pids = set()
+        self._server = self._listen()
+        # Icons scaled to `icon_size` by URL, in front of the ones stored on disk. They are
+        # kept for as long as tabs show them, see retain_tab_icons.
+        self._icon_cache = dict()
+        self._icon_validators = dict()
+        self._favicon_disk_cache = iconcache.FaviconDiskCache(icon_size)
+        self._icon_fetcher = glib_wrappers.UrlFetchScheduler(self._tab_icon_ready, self._tab_icon_failed)
+        # Not fetched again until the next time the switcher is shown
+        self._failed_icon_urls = set()
+        # Icons are not fetched while the switcher is hidden. The ones that are
+        # needed meanwhile are fetched once it is shown.
+        self._are_icon_fetches_paused = False
+        self._deferred_icon_urls = set()
+        self._icon_decoder = concurrent.futures.ThreadPoolExecutor(max_workers=self.NR_ICON_DECODING_THREADS)
 
         def read_and_update_tabs(pid, tabs):
+            self._populate_tabs_normalized_titles(tabs)
             self._populate_tabs_icons(tabs)
             update_tabs_callback(pid, tabs)
 
         self._update_tabs_callback = read_and_update_tabs
 
+    def _listen(self):
+        """Listen on the broker socket, to which the API proxies of all the browsers connect.
+
+        Returns None if it cannot be listened on, and then no tabs are listed.
+        """
+        path = tabprotocol.BROKER_SOCKET_PATH
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                # Left by a previous run
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            server.bind(path)
+            server.listen(self.LISTEN_BACKLOG)
+        except OSError as ex:
+            print("Cannot listen for API proxies on {}, tabs will not be listed: {}".format(path, ex))
+            server.close()
+            return None
+        server.setblocking(False)
+        GLib.io_add_watch(server.fileno(), GLib.IO_IN, self._accept_connections)
+        return server
+
+    def _accept_connections(self, fd, condition):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except BlockingIOError:
+                return True
+            except OSError as ex:
+                print("Failed accepting a connection from an API proxy: {}".format(ex))
+                return True
+            lister = BrowserTabLister(connection, self._browser_registered_callback,
+                                      self._browser_tabs_updated_callback, self._browser_disconnected_callback)
+            self._listers.append(lister)
+            lister.async_list_tabs()
+
     def async_list_browsers_tabs(self, active_browsers):
-        self._clean_stale_browsers(active_browsers)
+        """Make sure the tabs of the given browsers are being listed.
 
-        for browser in active_browsers:
-            if self._validate_connection_to_browser(browser.pid):
-                self.browsers[browser.pid].async_list_tabs()
+        Only the changes since the last listing are sent by the browsers'
+        API proxies.
+        """
+        self._active_browser_pids = set(browser.pid for browser in active_browsers)
+        self._match_browsers()
+        for listers in list(self.browsers.values()):
+            for lister in list(listers):
+                lister.async_list_tabs()
 
     def async_move_to_tab(self, tab_id, pid):
-        is_connected = self._validate_connection_to_browser(pid)
-        if is_connected:
-            self.browsers[pid].async_move_to_tab(tab_id)
-        else:
-            print("Warning: not connected to browser {}".format(pid))
-
-    def _validate_connection_to_browser(self, pid):
-        if pid not in self.browsers:
-            try:
-                browser = BrowserTabLister(pid, self._update_tabs_callback)
-                self.browsers[pid] = browser
-            except ApiProxyNotReady:
-                return False
-        return True
+        for lister in self.browsers.get(pid, ()):
+            if tab_id in lister.tab_table.tabs:
+                lister.async_move_to_tab(tab_id)
+                return
+        print("Warning: not connected to browser {}".format(pid))
+
+    def _match_browsers(self):
+        """Match the API proxies to the browser windows, and update the tabs of the windows whose
+        proxies changed."""
+        browsers = dict()
+        for lister in self._listers:
+            pid = lister.get_window_pid(self._active_browser_pids)
+            if pid is not None:
+                browsers.setdefault(pid, list()).append(lister)
+        # The tabs of windows that are gone are dropped by the caller
+        changed_pids = [pid for pid in self._active_browser_pids if browsers.get(pid) != self.browsers.get(pid)]
+        self.browsers = browsers
+        for pid in changed_pids:
+            self._update_browser_tabs(pid)
+
+    def _update_browser_tabs(self, pid):
+        tabs = [tab for lister in self.browsers.get(pid, ()) for tab in lister.tab_table.tabs.values()]
+        self._update_tabs_callback(pid, tabs)
+
+    def _browser_registered_callback(self, lister):
+        print("API proxy of browser {} registered".format(lister.browser_pid))
+        self._match_browsers()
+
+    def _browser_tabs_updated_callback(self, lister):
+        pid = lister.get_window_pid(self._active_browser_pids)
+        if lister in self.browsers.get(pid, ()):
+            self._update_browser_tabs(pid)
 
     def get_tab_icon(self, tab, fetch_if_missing=False):
-        icon = None
-        if 'favIconUrl' in tab and tab['favIconUrl'] is not None:
-            if tab['favIconUrl'] in self._icon_cache:
-                icon = self._icon_cache[tab['favIconUrl']]
+        url = tab.get('favIconUrl')
+        if not url:
+            return None
+        if url in self._icon_cache:
+            return self._icon_cache[url]
+        icon, validator, is_stale = self._favicon_disk_cache.get(url)
+        icon = self._icon_interner.intern(icon)
+        # Also marks icons that are being fetched, so they are fetched once
+        self._icon_cache[url] = icon
+        self._icon_validators[url] = validator
+        if icon is None or is_stale:
+            if self._are_icon_fetches_paused:
+                self._deferred_icon_urls.add(url)
             else:
-                # Async read icon from URL by scheduling the ready callback
-                self._icon_cache[tab['favIconUrl']] = None
-                url = tab["favIconUrl"]
-
-                for image_prefix in KNOWN_ICON_TYPES:
-                    # Try parsing image as inline
-                    image = None
-                    is_base64 = False
-
-                    # Populate `image` and `is_base64`
-                    if url.startswith("data:image/{},".format(image_prefix)):
-                        image_type, image = url.split('/', 1)[1].split(',', 1)
-                        if image_type in KNOWN_BASE64_ICON_TYPES:
-                            is_base64 = True
-                    elif url.startswith("data:image/{};".format(image_prefix)):
-                        _, parameter_and_image = url.split('/', 1)[1].split(';', 1)
-
-                        if parameter_and_image.startswith("base64,"):
-                            image = parameter_and_image.split(',', 1)[1]
-                            is_base64 = True
-
-                    # Act on `image` and `base64`
-                    if image is not None:
-                        if is_base64:
-                            image = base64.b64decode(image)
-                        self._tab_icon_ready(url, image)
-                        break
-                else:
-                    # Parse image as URL
-                    if url is not None and url:
-                        glib_wrappers.async_get_url(url, self._tab_icon_ready)
+                self._async_fetch_tab_icon(url)
         return icon
 
-    def _tab_icon_ready(self, url, contents):
+    def _async_fetch_tab_icon(self, url):
+        for image_prefix in KNOWN_ICON_TYPES:
+            # Try parsing image as inline
+            image = None
+            is_base64 = False
+
+            # Populate `image` and `is_base64`
+            if url.startswith("data:image/{},".format(image_prefix)):
+                image_type, image = url.split('/', 1)[1].split(',', 1)
+                if image_type in KNOWN_BASE64_ICON_TYPES:
+                    is_base64 = True
+            elif url.startswith("data:image/{};".format(image_prefix)):
+                _, parameter_and_image = url.split('/', 1)[1].split(';', 1)
+
+                if parameter_and_image.startswith("base64,"):
+                    image = parameter_and_image.split(',', 1)[1]
+                    is_base64 = True
+
+            # Act on `image` and `base64`
+            if image is not None:
+                self._async_decode_tab_icon(url, image, is_base64=is_base64)
+                break
+        else:
+            # Parse image as URL
+            self._icon_fetcher.fetch(url)
+
+    def get_cached_tab_icons(self):
+        return [icon for icon in self._icon_cache.values() if icon is not None]
+
+    def retain_tab_icons(self, urls):
+        """Evict the icons whose URLs are not in `urls`, which tabs still show."""
+        stale_urls = [url for url in self._icon_cache if url not in urls]
+        for url in stale_urls:
+            del self._icon_cache[url]
+            self._icon_validators.pop(url, None)
+        self._deferred_icon_urls.intersection_update(self._icon_cache)
+
+    def pause_icon_fetches(self):
+        """Stop fetching icons until resume_icon_fetches, which fetches the ones that are still missing."""
+        self._are_icon_fetches_paused = True
+        self._deferred_icon_urls.update(self._icon_fetcher.cancel_all())
+        self._deferred_icon_urls.update(self._failed_icon_urls)
+        self._failed_icon_urls.clear()
+
+    def resume_icon_fetches(self):
+        self._are_icon_fetches_paused = False
+        deferred_icon_urls = self._deferred_icon_urls
+        self._deferred_icon_urls = set()
+        for url in deferred_icon_urls:
+            if url in self._icon_cache:
+                self._async_fetch_tab_icon(url)
+
+    def _tab_icon_failed(self, url):
+        self._failed_icon_urls.add(url)
+
+    def _tab_icon_ready(self, url, contents, etag):
+        self._async_decode_tab_icon(url, contents, etag=etag)
+
+    def _async_decode_tab_icon(self, url, contents, etag=None, is_base64=False):
+        cached_icon = self._icon_cache.get(url)
+        cached_validator = None if cached_icon is None else self._icon_validators.get(url)
+        self._icon_decoder.submit(self._decode_tab_icon, url, contents, etag, is_base64, cached_icon,
+                                  cached_validator)
+
+    def _decode_tab_icon(self, url, contents, etag, is_base64, cached_icon, cached_validator):
+        # Runs in a worker thread, and hands only new icons to the main loop
+        icon = None
         try:
-            input_stream = Gio.MemoryInputStream.new_from_data(contents, None)
-            pixbuf = Pixbuf.new_from_stream(input_stream, None)
-        except:
+            if is_base64:
+                contents = base64.b64decode(contents)
+            elif isinstance(contents, str):
+                contents = contents.encode('utf-8')
+            validator = etag or hashlib.blake2b(contents, digest_size=16).hexdigest()
+            if validator != cached_validator:
+                icon = iconcache.decode_icon(contents, self._icon_size)
+        except Exception:
             print(traceback.format_exc())
-            print("Error generating icon from {}".format(url))
+            print("Error generating icon from {}".format(url[:100]))
             return
-        self._icon_cache[url] = pixbuf
-        self._update_tab_icon_callback(url, contents)
-
-    def _clean_stale_browsers(self, active_browsers):
-        active_browser_pids = set([browser.pid for browser in active_browsers])
-        stale_browser_pids = [browser_pid for browser_pid in self.browsers.keys()
-                              if browser_pid not in active_browser_pids]
-
-        for browser in stale_browser_pids:
-            browser.clean_fds()
-            del self.browsers[browser.pid]
+        # Encoding and writing the PNG are slow, so they are not left to the main loop.
+        # A revalidated icon that did not change is written again for its new fetch time.
+        self._favicon_disk_cache.put(url, cached_icon if icon is None else icon, validator)
+        if icon is not None:
+            GLib.idle_add(self._tab_icon_decoded, url, icon, validator)
+
+    def _tab_icon_decoded(self, url, icon, validator):
+        icon = self._icon_interner.intern(icon)
+        self._icon_cache[url] = icon
+        self._icon_validators[url] = validator
+        self._update_tab_icon_callback(url, icon)
+        return False
+
+    def _browser_disconnected_callback(self, lister):
+        print("Disconnected from browser {}".format(lister.browser_pid))
+        if lister in self._listers:
+            self._listers.remove(lister)
+            self._match_browsers()
+
+    @staticmethod
+    def _populate_tabs_normalized_titles(tabs):
+        # Tabs that did not change since the last update keep their normalized title
+        for tab in tabs:
+            if 'normalized_title' not in tab:
+                tab['normalized_title'] = listfilter.normalize(tab['title'])
 
     def _populate_tabs_icons(self, tabs):
         for tab in tabs:
@@ -0,0 +1,257 @@
+"""The protocol between the switcher and the browsers' API proxies.
+
+The switcher listens on a Unix stream socket, and the API proxy of every
+browser connects to it. A proxy first registers, telling the PIDs of the
+processes it descends from, so the switcher can tell which windows belong
+to its browser.
+
+Every message is a frame: a header with the protocol version, the encoding
+of the payload and the payload's length, followed by the payload.
+
+The proxy keeps a versioned table of its browser's tabs. The switcher asks
+for the changes since the version it has (the `sync` op) and gets either a
+delta (changed tabs and removed tab ids) or, if the proxy cannot tell what
+changed since that version, a snapshot of all the tabs. Later changes are
+pushed to the switcher as deltas. The reply to a sync carries the id of
+the sync request, pushed deltas carry no id.
+"""
+import os
+import json
+import struct
+import marshal
+
+
+BROKER_SOCKET_PATH = os.path.join('/run', 'user', str(os.getuid()), "textual-switcher-proxy.sock")
+PROTOCOL_VERSION = 1
+ENCODING_JSON = 0
+# Both ends are run by the same python installation, so its own binary
+# format can be used. It is faster to decode than JSON.
+ENCODING_MARSHAL = 1
+FRAME_HEADER = struct.Struct('=BBI')
+
+OP_REGISTER = 'register'
+OP_SYNC = 'sync'
+OP_MOVE_TO_TAB = 'move_to_tab'
+OP_SNAPSHOT = 'snapshot'
+OP_DELTA = 'delta'
+
+
+class ProtocolError(Exception): pass
+
+
+def _encode_json(message):
+    return json.dumps(message, separators=(',', ':')).encode('utf-8')
+
+
+def _decode_json(payload):
+    # Decoded straight from the reader's buffer, without copying it to bytes
+    return json.loads(str(payload, 'utf-8'))
+
+
+_ENCODERS = {ENCODING_JSON: _encode_json, ENCODING_MARSHAL: marshal.dumps}
+_DECODERS = {ENCODING_JSON: _decode_json, ENCODING_MARSHAL: marshal.loads}
+
+
+def encode_frame(message, encoding=ENCODING_JSON):
+    payload = _ENCODERS[encoding](message)
+    return FRAME_HEADER.pack(PROTOCOL_VERSION, encoding, len(payload)) + payload
+
+
+def decode_payload(version, encoding, payload):
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError("Unsupported protocol version {}".format(version))
+    if encoding not in _DECODERS:
+        raise ProtocolError("Unsupported encoding {}".format(encoding))
+    try:
+        return _DECODERS[encoding](payload)
+    except Exception as ex:
+        raise ProtocolError("Cannot decode payload of {} bytes: {}".format(len(payload), ex))
+
+
+class FramedReader(object):
+    """Reads frames from a non blocking fd.
+
+    Data is read straight into a reusable buffer, as much as is available
+    in every read, and frames are decoded from a view of the buffer. The
+    buffer grows to fit a whole frame once its header was read.
+    """
+    INITIAL_BUFFER_SIZE = 2 ** 16
+    MIN_READ_SIZE = 2 ** 12
+    # Buffers that grew beyond this for a big frame are not kept once empty
+    MAX_IDLE_BUFFER_SIZE = 2 ** 20
+
+    def __init__(self, fd):
+        self._fd = fd
+        self._set_buffer(bytearray(self.INITIAL_BUFFER_SIZE))
+        # The data that was read and not popped yet is _buffer[_start:_end]
+        self._start = 0
+        self._end = 0
+        self.nr_bytes_read = 0
+
+    def read(self):
+        """Read everything that is available. Returns False if the writer closed the fd."""
+        while True:
+            if len(self._buffer) - self._end < self.MIN_READ_SIZE:
+                self._make_room()
+            try:
+                nr_bytes = os.readv(self._fd, [self._view[self._end:]])
+            except BlockingIOError:
+                return True
+            if nr_bytes == 0:
+                return False
+            self._end += nr_bytes
+            self.nr_bytes_read += nr_bytes
+
+    def pop_message(self):
+        """Return the next complete message, or None if there is none yet.
+
+        Raises ProtocolError for a frame that cannot be decoded. The frame is
+        dropped, so the following messages can still be popped.
+        """
+        frame_size = self._get_frame_size()
+        if frame_size is None or self._end - self._start < frame_size:
+            return None
+        version, encoding, _ = FRAME_HEADER.unpack_from(self._buffer, self._start)
+        payload = self._view[self._start + FRAME_HEADER.size:self._start + frame_size]
+        self._start += frame_size
+        try:
+            return decode_payload(version, encoding, payload)
+        finally:
+            payload.release()
+            if self._start == self._end:
+                self._start = self._end = 0
+                if len(self._buffer) > self.MAX_IDLE_BUFFER_SIZE:
+                    self._set_buffer(bytearray(self.INITIAL_BUFFER_SIZE))
+
+    def _get_frame_size(self):
+        if self._end - self._start < FRAME_HEADER.size:
+            return None
+        return FRAME_HEADER.size + FRAME_HEADER.unpack_from(self._buffer, self._start)[2]
+
+    def _make_room(self):
+        nr_pending_bytes = self._end - self._start
+        frame_size = self._get_frame_size()
+        if frame_size is not None and frame_size > nr_pending_bytes:
+            # Make room for the rest of the frame, to read it in as few reads as possible
+            required_size = new_size = frame_size
+        else:
+            required_size = nr_pending_bytes + self.MIN_READ_SIZE
+            new_size = max(required_size, 2 * len(self._buffer))
+        if required_size <= len(self._buffer):
+            self._view[:nr_pending_bytes] = self._view[self._start:self._end]
+        else:
+            buffer = bytearray(new_size)
+            buffer[:nr_pending_bytes] = self._view[self._start:self._end]
+            self._set_buffer(buffer)
+        self._start = 0
+        self._end = nr_pending_bytes
+
+    def _set_buffer(self, buffer):
+        if hasattr(self, '_view'):
+            self._view.release()
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+
+
+def register_op(browser_pid, ancestor_pids):
+    return {'op': OP_REGISTER, 'browser_pid': browser_pid, 'pids': ancestor_pids}
+
+
+def sync_op(epoch, since, request_id):
+    return {'op': OP_SYNC, 'epoch': epoch, 'since': since, 'id': request_id}
+
+
+def move_to_tab_op(tab_id):
+    return {'op': OP_MOVE_TO_TAB, 'tab_id': tab_id}
+
+
+class TabTable(object):
+    """Tabs by id, versioned so that the changes since any version are known.
+
+    The proxy holds the authoritative table, whose epoch identifies it, and
+    every change to a tab gives it a new version. The switcher holds a
+    mirror of it that is updated with the proxy's snapshots and deltas.
+    """
+    # Removed tabs are remembered for deltas. Older removals are forgotten,
+    # and switchers that did not sync since get a snapshot.
+    MAX_TOMBSTONES = 1000
+
+    def __init__(self, epoch=None):
+        self.epoch = epoch
+        self.version = 0
+        self.tabs = dict()
+        self._tab_versions = dict()
+        self._tombstones = dict()
+        # Deltas can only be computed from this version on
+        self._horizon = 0
+
+    def set_tabs(self, tabs):
+        """Replace all the tabs. Returns the ids of the tabs that changed."""
+        tabs = {tab['id']: tab for tab in tabs}
+        removed_tab_ids = [tab_id for tab_id in self.tabs if tab_id not in tabs]
+        changed_tab_ids = [tab_id for tab_id in removed_tab_ids if self.remove_tab(tab_id)]
+        changed_tab_ids.extend(tab_id for tab_id, tab in tabs.items() if self.update_tab(tab))
+        return changed_tab_ids
+
+    def update_tab(self, tab):
+        tab_id = tab['id']
+        if self.tabs.get(tab_id) == tab:
+            return False
+        self.version += 1
+        self.tabs[tab_id] = tab
+        self._tab_versions[tab_id] = self.version
+        self._tombstones.pop(tab_id, None)
+        return True
+
+    def remove_tab(self, tab_id):
+        if tab_id not in self.tabs:
+            return False
+        self.version += 1
+        del self.tabs[tab_id]
+        del self._tab_versions[tab_id]
+        self._tombstones[tab_id] = self.version
+        if len(self._tombstones) > self.MAX_TOMBSTONES:
+            # Tombstones are inserted in the order of their versions
+            oldest_tab_id = next(iter(self._tombstones))
+            self._horizon = self._tombstones.pop(oldest_tab_id)
+        return True
+
+    def get_changes_since(self, epoch, since):
+        """A delta from the given version, or a snapshot if it is unknown."""
+        if epoch != self.epoch or since is None or not self._horizon <= since <= self.version:
+            return {'op': OP_SNAPSHOT, 'epoch': self.epoch, 'version': self.version,
+                    'tabs': list(self.tabs.values())}
+        return {'op': OP_DELTA, 'epoch': self.epoch, 'since': since, 'version': self.version,
+                'changed': [self.tabs[tab_id] for tab_id, version in self._tab_versions.items()
+                            if version > since],
+                'removed': [tab_id for tab_id, version in self._tombstones.items() if version > since]}
+
+    def get_changes_of(self, since, tab_ids):
+        """A delta from the given version that carries only the given tabs.
+
+        For pushing a change whose tabs are known, when they are the only
+        ones that changed since that version. Unlike get_changes_since, it
+        costs as much as the changed tabs rather than the whole table.
+        """
+        return {'op': OP_DELTA, 'epoch': self.epoch, 'since': since, 'version': self.version,
+                'changed': [self.tabs[tab_id] for tab_id in tab_ids if tab_id in self.tabs],
+                'removed': [tab_id for tab_id in tab_ids if tab_id not in self.tabs]}
+
+    def apply(self, message):
+        """Apply a snapshot or a delta to a mirror of a table.
+
+        Returns whether the delta applies to the mirror's version. If it does
+        not, the mirror should sync again.
+        """
+        if message['op'] == OP_SNAPSHOT:
+            self.tabs = {tab['id']: tab for tab in message['tabs']}
+        elif message['epoch'] == self.epoch and message['since'] == self.version:
+            for tab_id in message['removed']:
+                self.tabs.pop(tab_id, None)
+            for tab in message['changed']:
+                self.tabs[tab['id']] = tab
+        else:
+            return False
+        self.epoch = message['epoch']
+        self.version = message['version']
+        return True
@@ -1,9 +1,10 @@
+import os
+import traceback
 import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
 gi.require_version('Wnck', '3.0')
 from gi.repository import Wnck, GLib
 
+import listfilter
 import glib_wrappers
 
 
@@ -15,8 +16,11 @@ class Window(object):
         self.pid = None
         self.wm_class = None
         self.title = None
+        self.normalized_title = None
+        self.normalized_wm_class = None
         self.destkop_id = None
         self.hostname = None
+        self.icon = None
 
     def is_browser(self):
         return self.wm_class in self.BROWSERS_WM_CLASSES
@@ -24,34 +28,215 @@ class Window(object):
 
 class WindowControl(object):
     LIST_WINDOWS_COMMAND = ["wmctrl", "-lpx"]
+    WNCK_BACKEND = "wnck"
+    WMCTRL_BACKEND = "wmctrl"
+    # Set to "wmctrl" to list windows by running wmctrl instead of through Wnck
+    BACKEND_ENV_VAR = "TEXTUAL_SWITCHER_WINDOW_BACKEND"
+    # Safety net against missed Wnck events
+    RESYNC_INTERVAL_SECONDS = 60
 
-    def async_list_windows(self, callback):
+    def __init__(self, backend=None, icon_interner=None):
+        if backend is None:
+            backend = os.environ.get(self.BACKEND_ENV_VAR, self.WNCK_BACKEND)
+        self._backend = backend
+        self._icon_interner = icon_interner
+        self._live_windows = None
+        self._watched_xids = set()
+        # Windows listed by wmctrl whose icon changes are watched, by XID, with
+        # their Wnck window and the handler of its icon-changed signal
+        self._icon_watched_windows = dict()
+        self._icons_callback = None
+        self._windows_changed_callback = None
+
+    def watch_windows(self, windows_changed_callback):
+        """Keep a live model of the windows, updated by Wnck's screen signals.
+
+        `windows_changed_callback(updated_windows, removed_xids)` is called with
+        the current windows once, and then whenever windows are opened, closed,
+        renamed or change their class or icon. The model is also fully
+        resynced periodically. Returns False if the live model is not available
+        with the selected backend.
+        """
+        if self._backend != self.WNCK_BACKEND:
+            return False
+        try:
+            self._get_wnck_screen()
+        except Exception:
+            print(traceback.format_exc())
+            return False
+        self._windows_changed_callback = windows_changed_callback
+        self._live_windows = dict()
+        # Start from the main loop, since the callback may not be ready for calls yet
+        GLib.idle_add(self._start_watching_windows)
+        return True
+
+    def is_watching_windows(self):
+        return self._live_windows is not None
+
+    def _start_watching_windows(self):
+        screen = self._get_wnck_screen()
+        screen.connect("window-opened", self._wnck_window_opened_callback)
+        screen.connect("window-closed", self._wnck_window_closed_callback)
+        # Emits window-opened for the windows Wnck did not know of yet
+        screen.force_update()
+        for wnck_window in screen.get_windows():
+            if wnck_window.get_xid() not in self._watched_xids:
+                self._wnck_window_opened_callback(screen, wnck_window)
+        GLib.timeout_add_seconds(self.RESYNC_INTERVAL_SECONDS, self._resync)
+        return False
+
+    def _wnck_window_opened_callback(self, screen, wnck_window):
+        self._watched_xids.add(wnck_window.get_xid())
+        for signal_name in ("name-changed", "class-changed", "icon-changed"):
+            wnck_window.connect(signal_name, self._wnck_window_changed_callback)
+        self._wnck_window_changed_callback(wnck_window)
+
+    def _wnck_window_changed_callback(self, wnck_window):
+        window = self._create_window_from_wnck(wnck_window)
+        if self._is_listed(window):
+            self._set_normalized_fields(window)
+            self._live_windows[window.xid] = window
+            self._windows_changed_callback([window], [])
+        elif window.xid in self._live_windows:
+            del self._live_windows[window.xid]
+            self._windows_changed_callback([], [window.xid])
+
+    def _wnck_window_closed_callback(self, screen, wnck_window):
+        xid = wnck_window.get_xid()
+        self._watched_xids.discard(xid)
+        if xid in self._live_windows:
+            del self._live_windows[xid]
+            self._windows_changed_callback([], [xid])
+
+    def _resync(self):
+        try:
+            windows = self.list_windows_from_wnck()
+        except Exception:
+            print(traceback.format_exc())
+        else:
+            self._update_live_windows(windows)
+        return True
+
+    def _update_live_windows(self, windows):
+        windows = {window.xid: window for window in windows}
+        removed_xids = [xid for xid in self._live_windows if xid not in windows]
+        updated_windows = [window for xid, window in windows.items()
+                           if not self._is_same_window(self._live_windows.get(xid), window)]
+        self._live_windows = windows
+        if removed_xids or updated_windows:
+            GLib.idle_add(self._windows_changed_callback, updated_windows, removed_xids)
+
+    @staticmethod
+    def _is_same_window(window_a, window_b):
+        if window_a is None or window_b is None:
+            return False
+        return (window_a.title == window_b.title and window_a.wm_class == window_b.wm_class and
+                window_a.pid == window_b.pid and window_a.icon is window_b.icon)
+
+    def async_list_windows(self, callback, icons_callback=None):
+        """List windows, calling back with them from the main loop.
+
+        Windows may be listed before their icons are known. In that case
+        their icon is None, and `icons_callback(windows)` is called later
+        for the windows whose icons were attached.
+        """
+        if self._backend == self.WNCK_BACKEND:
+            try:
+                windows = self.list_windows_from_wnck()
+            except Exception:
+                print(traceback.format_exc())
+                print("Cannot list windows through Wnck, falling back to wmctrl")
+                self._backend = self.WMCTRL_BACKEND
+            else:
+                if self.is_watching_windows():
+                    self._update_live_windows(windows)
+                # Keep the callback asynchronous, as callers may not be ready for it yet
+                GLib.idle_add(callback, windows)
+                return
+        self._async_list_windows_from_wmctrl(callback, icons_callback)
+
+    def _async_list_windows_from_wmctrl(self, callback, icons_callback):
         stdout = glib_wrappers.async_run_subprocess(self.LIST_WINDOWS_COMMAND)
         io = GLib.IOChannel(stdout)
 
         def list_windows_callback(*_, **__):
             output = io.read()
             windows = self.parse_wlist_output(output)
-            icons = self._get_icons()
-            for window in windows:
-                window.icon = icons.get(window.xid, None)
+            # Publish the list first, icons are attached once the main loop is idle
             callback(windows)
+            GLib.idle_add(self._attach_icons, windows, icons_callback)
 
         io.add_watch(GLib.IO_IN | GLib.IO_HUP, list_windows_callback)
 
+    def focus_on_window(self, window_id, timestamp):
+        """Switch to the desktop of a window, raise it and focus it.
+
+        `timestamp` is the X server time of the event that triggered the
+        activation. Returns False if the window no longer exists.
+        """
+        if self._backend == self.WNCK_BACKEND:
+            wnck_window = Wnck.Window.get(window_id)
+            if wnck_window is None:
+                return False
+            workspace = wnck_window.get_workspace()
+            if workspace is not None and workspace != wnck_window.get_screen().get_active_workspace():
+                workspace.activate(timestamp)
+            wnck_window.activate(timestamp)
+        else:
+            command = ["wmctrl", "-ia", hex(window_id)]
+            glib_wrappers.async_run_subprocess(command)
+        return True
+
     @staticmethod
-    def focus_on_window(window_id):
-        window_id = hex(window_id)
-        command = ["wmctrl", "-ia", window_id]
-        glib_wrappers.async_run_subprocess(command)
+    def _get_wnck_screen():
+        screen = Wnck.Screen.get_default()
+        if screen is None:
+            raise RuntimeError("No default Wnck screen")
+        return screen
+
+    def list_windows_from_wnck(self):
+        """List windows with a single pass over Wnck's client list (_NET_CLIENT_LIST)."""
+        screen = self._get_wnck_screen()
+        screen.force_update()
+        windows = list()
+        for wnck_window in screen.get_windows():
+            window = self._create_window_from_wnck(wnck_window)
+            if self._is_listed(window):
+                self._set_normalized_fields(window)
+                windows.append(window)
+        return windows
 
-    def async_focus_on_window(self, window_id):
-        window_id = hex(window_id)
-        command = ["wmctrl", "-iR", window_id]
-        glib_wrappers.async_run_subprocess(command)
+    def _create_window_from_wnck(self, wnck_window):
+        window = Window()
+        window.xid = wnck_window.get_xid()
+        window.pid = wnck_window.get_pid()
+        window.wm_class = self._get_wm_class_of_wnck_window(wnck_window)
+        workspace = wnck_window.get_workspace()
+        # Like wmctrl, -1 stands for a window that is shown on all desktops
+        window.desktop_id = str(-1 if workspace is None else workspace.get_number())
+        window.title = wnck_window.get_name()
+        window.icon = self._get_wnck_window_icon(wnck_window)
+        return window
+
+    def _get_wnck_window_icon(self, wnck_window):
+        icon = wnck_window.get_icon()
+        if self._icon_interner is not None:
+            # Windows of one application usually have identical icons, which are
+            # then scaled once. Wnck keeps its own reference to every icon.
+            icon = self._icon_interner.intern(icon, is_held_elsewhere=True)
+        return icon
 
     @staticmethod
-    def parse_wlist_output(wlist_output):
+    def _get_wm_class_of_wnck_window(wnck_window):
+        # Formatted as wmctrl does, i.e. "<instance name>.<class name>"
+        instance_name = wnck_window.get_class_instance_name()
+        class_name = wnck_window.get_class_group_name()
+        if not instance_name and not class_name:
+            return "N/A"
+        return "{}.{}".format(instance_name or "", class_name or "")
+
+    @classmethod
+    def parse_wlist_output(cls, wlist_output):
         windows = list()
         for line in wlist_output.splitlines():
             window = Window()
@@ -70,19 +255,61 @@ class WindowControl(object):
             line = line.lstrip()
             window.hostname, line = line.split(" ", 1)
             window.title = line.lstrip()
-            if window.title == "Desktop":
-                continue
-            # Filter out non-existing windows, see https://askubuntu.com/questions/1345101/what-is-72-27bdh-and-0-27bdh
-            if window.title.startswith('@') and (window.title.endswith(';BDH') or window.title.endswith(';BDHF')):
+            if not cls._is_listed(window):
                 continue
+            cls._set_normalized_fields(window)
             windows.append(window)
         return windows
 
-    def _get_icons(self):
+    @staticmethod
+    def _is_listed(window):
+        if window.wm_class == "N/A":
+            return False
+        if window.title == "Desktop":
+            return False
+        # Filter out non-existing windows, see https://askubuntu.com/questions/1345101/what-is-72-27bdh-and-0-27bdh
+        if window.title.startswith('@') and (window.title.endswith(';BDH') or window.title.endswith(';BDHF')):
+            return False
+        return True
+
+    @staticmethod
+    def _set_normalized_fields(window):
+        window.normalized_title = listfilter.normalize(window.title)
+        window.normalized_wm_class = listfilter.normalize(window.wm_class)
+
+    def _attach_icons(self, windows, icons_callback):
         screen = Wnck.Screen.get_default()
-        # The following is needed in order to wait for windows to ready
-        while Gtk.events_pending():
-            Gtk.main_iteration()
+        if screen is None:
+            return False
+        # A plain round trip to the X server, unlike running the main loop
+        # until Wnck is ready, this cannot dispatch unrelated events
         screen.force_update()
-        icons = {w.get_xid(): w.get_icon() for w in screen.get_windows()}
-        return icons
+        self._icons_callback = icons_callback
+        windows_by_xid = {window.xid: window for window in windows}
+        for wnck_window in screen.get_windows():
+            window = windows_by_xid.get(wnck_window.get_xid())
+            if window is not None:
+                window.icon = self._get_wnck_window_icon(wnck_window)
+                self._watch_wnck_window_icon(wnck_window, window)
+        # Windows that were closed since, which the process would otherwise keep watching for good
+        for xid in [xid for xid in self._icon_watched_windows if xid not in windows_by_xid]:
+            wnck_window, handler_id, _ = self._icon_watched_windows.pop(xid)
+            wnck_window.disconnect(handler_id)
+        if icons_callback is not None:
+            icons_callback(windows)
+        return False
+
+    def _watch_wnck_window_icon(self, wnck_window, window):
+        # Wnck may report a fallback icon until the actual one is loaded
+        xid = wnck_window.get_xid()
+        if xid in self._icon_watched_windows:
+            _, handler_id, _ = self._icon_watched_windows[xid]
+        else:
+            handler_id = wnck_window.connect("icon-changed", self._wnck_window_icon_changed_callback)
+        self._icon_watched_windows[xid] = (wnck_window, handler_id, window)
+
+    def _wnck_window_icon_changed_callback(self, wnck_window):
+        _, _, window = self._icon_watched_windows.get(wnck_window.get_xid(), (None, None, None))
+        if window is not None and self._icons_callback is not None:
+            window.icon = self._get_wnck_window_icon(wnck_window)
+            self._icons_callback([window])
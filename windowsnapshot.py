@@ -0,0 +1,93 @@
+"""The last known windows and tabs, persisted so that a cold start can show them right away.
+
+The file is a small header followed by compact JSON. It is read through
+mmap, straight from the page cache, since it is read on every cold start.
+"""
+import os
+import json
+import mmap
+import struct
+
+
+SNAPSHOT_FILENAME = "textual-switcher-snapshot"
+MAGIC = b'TSWS'
+FORMAT_VERSION = 1
+# Magic, format version and the length of the payload
+HEADER = struct.Struct('=4sII')
+
+
+class SnapshotWindow(object):
+    """A window as it was when the snapshot was saved.
+
+    Has the attributes of windowcontrol.Window that the switcher shows, and
+    no icon.
+    """
+    def __init__(self, xid, pid, wm_class, title, normalized_title, normalized_wm_class, is_browser):
+        self.xid = xid
+        self.pid = pid
+        self.wm_class = wm_class
+        self.title = title
+        self.normalized_title = normalized_title
+        self.normalized_wm_class = normalized_wm_class
+        self.icon = None
+        self._is_browser = is_browser
+
+    def is_browser(self):
+        return self._is_browser
+
+
+def get_snapshot_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or os.path.join('/run', 'user', str(os.getuid()))
+    return os.path.join(runtime_dir, SNAPSHOT_FILENAME)
+
+
+def save(path, windows, tabs):
+    """Save the windows, and the tabs by the PID of their browser. The file is replaced atomically."""
+    snapshot = {'windows': [[window.xid, window.pid, window.wm_class, window.title, window.normalized_title,
+                             window.normalized_wm_class, window.is_browser()]
+                            for window in windows],
+                # Only what is shown, icons are referred to by their URL
+                'tabs': [[pid, [[tab['id'], tab['title'], tab['normalized_title'], tab.get('favIconUrl')]
+                                for tab in browser_tabs]]
+                         for pid, browser_tabs in tabs.items()]}
+    payload = json.dumps(snapshot, separators=(',', ':')).encode('utf-8')
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(payload)) + payload)
+    os.replace(temp_path, path)
+
+
+def load(path):
+    """Return the saved windows and tabs by browser PID, or None if there is no valid snapshot."""
+    try:
+        with open(path, 'rb') as snapshot_file:
+            with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                snapshot = _decode(mapping)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as ex:
+        # Also raised for an empty file, which cannot be mapped
+        print("Cannot read the snapshot of windows: {}".format(ex))
+        return None
+    if snapshot is None:
+        return None
+    try:
+        windows = [SnapshotWindow(*window) for window in snapshot['windows']]
+        tabs = {pid: [{'id': tab_id, 'title': title, 'normalized_title': normalized_title, 'favIconUrl': url}
+                      for tab_id, title, normalized_title, url in browser_tabs]
+                for pid, browser_tabs in snapshot['tabs']}
+    except (KeyError, TypeError, ValueError) as ex:
+        print("Invalid snapshot of windows: {}".format(ex))
+        return None
+    return windows, tabs
+
+
+def _decode(mapping):
+    if len(mapping) < HEADER.size:
+        return None
+    magic, version, length = HEADER.unpack_from(mapping)
+    if magic != MAGIC or version != FORMAT_VERSION or HEADER.size + length > len(mapping):
+        return None
+    # Decoded from the mapping, which cannot be closed before the view is released
+    with memoryview(mapping)[HEADER.size:HEADER.size + length] as payload:
+        return json.loads(str(payload, 'utf-8'))